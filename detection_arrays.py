@@ -0,0 +1,44 @@
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+
+
+SIZE_THRESHOLDS = (10.0, 1.0, 0.1)  # areaPercentage lower bounds of "large", "meduim", "small"
+
+
+def result_arrays(result, conf_threshold: float = 0.0) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Boxes of one ultralytics result as NumPy arrays, in one host transfer:
+    xyxy (N, 4) float64, conf (N,) float64 and cls (N,) int, keeping only conf >= conf_threshold.
+    """
+    boxes = result.boxes
+    if boxes is None or len(boxes) == 0:
+        return np.empty((0, 4)), np.empty(0), np.empty(0, dtype=int)
+    data = boxes.data.cpu().numpy()  # x1, y1, x2, y2, [track id,] conf, cls
+    conf = data[:, -2].astype(np.float64)
+    keep = conf >= conf_threshold
+    return data[keep, :4].astype(np.float64), conf[keep], data[keep, -1].astype(int)
+
+
+def class_names(result, cls: np.ndarray) -> List[str]:
+    return [result.names[c] for c in cls.tolist()]
+
+
+def size_categories(area_percentage: np.ndarray, smallest: str) -> List[str]:
+    """Size bucket per box: "large" / "meduim" / "small", else smallest."""
+    large, medium, small = SIZE_THRESHOLDS
+    return np.select(
+        [area_percentage >= large, area_percentage >= medium, area_percentage >= small],
+        ["large", "meduim", "small"], default=smallest,
+    ).tolist()
+
+
+def detections_summary(xyxy: np.ndarray, conf: np.ndarray, cls: np.ndarray, names: List[str],
+                       decimals: int = 5) -> List[Dict[str, Any]]:
+    """Same list of dicts as result.to_json() for plain detections, built from the arrays."""
+    return [
+        {"name": name, "class": c, "confidence": round(score, decimals),
+         "box": {"x1": round(x1, decimals), "y1": round(y1, decimals),
+                 "x2": round(x2, decimals), "y2": round(y2, decimals)}}
+        for name, c, score, (x1, y1, x2, y2) in zip(names, cls.tolist(), conf.tolist(), xyxy.tolist())
+    ]
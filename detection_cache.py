@@ -0,0 +1,96 @@
+import os
+import time
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+
+import numpy as np
+
+
+DETECTION_CACHE_FILE = "detection_cache.sqlite"
+CACHE_MAX_MB = 512
+CACHE_FORMAT = "f64"  # part of the key: entries of an older blob format are never decoded, only evicted
+
+CREATE_ENTRIES_TABLE = """
+CREATE TABLE IF NOT EXISTS entries (
+    cache_key TEXT PRIMARY KEY,
+    img_height INTEGER NOT NULL,
+    img_width INTEGER NOT NULL,
+    boxes BLOB NOT NULL,
+    nbytes INTEGER NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+
+class DetectionCache:
+    """
+    Raw YOLO boxes keyed by (media content hash, weights hash, imgsz, conf), shared across studies and re-runs.
+    Boxes are stored as float64 (N, 6) arrays (x1, y1, x2, y2, conf, cls) with the image size, exactly as
+    result_arrays() returns them, so a hit builds the same DB rows as running the model.
+    Least recently used entries are evicted once the stored boxes exceed max_mb.
+    """
+
+    def __init__(self, path: str, weights_hash: str, imgsz: int, conf: float, max_mb: float = CACHE_MAX_MB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.prefix = f"{CACHE_FORMAT}:{weights_hash}:{imgsz}:{conf:g}:"
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.hits = self.misses = self.evictions = 0
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(CREATE_ENTRIES_TABLE)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+        self._conn.commit()
+
+    def get_many(self, content_hashes: Iterable[str]) -> Dict[str, Tuple[Tuple[int, int], np.ndarray]]:
+        """{content_hash: ((height, width), boxes)} for the hashes in the cache; hits are marked as used."""
+        wanted = set(content_hashes)
+        found = {}
+        for content_hash in wanted:
+            row = self._conn.execute("SELECT img_height, img_width, boxes FROM entries WHERE cache_key = ?",
+                                     (self.prefix + content_hash,)).fetchone()
+            if row:
+                found[content_hash] = ((row[0], row[1]), np.frombuffer(row[2], dtype=np.float64).reshape(-1, 6))
+        self.hits += len(found)
+        self.misses += len(wanted) - len(found)
+        now = time.time()
+        self._conn.executemany("UPDATE entries SET last_used = ? WHERE cache_key = ?",
+                               [(now, self.prefix + content_hash) for content_hash in found])
+        self._conn.commit()
+        return found
+
+    def put_many(self, entries: Iterable[Tuple[str, Tuple[int, int], np.ndarray]]):
+        """Store (content_hash, (height, width), boxes) entries in one transaction, then evict if over budget."""
+        now = time.time()
+        rows = []
+        for content_hash, (height, width), boxes in entries:
+            blob = np.ascontiguousarray(boxes, dtype=np.float64).tobytes()
+            rows.append((self.prefix + content_hash, int(height), int(width), blob, len(blob), now))
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO entries (cache_key, img_height, img_width, boxes, nbytes, last_used)"
+            " VALUES (?, ?, ?, ?, ?, ?)", rows)
+        self._conn.commit()
+        self.evict()
+
+    def evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        stale = []
+        for cache_key, nbytes in self._conn.execute("SELECT cache_key, nbytes FROM entries ORDER BY last_used"):
+            if total <= self.max_bytes:
+                break
+            stale.append((cache_key,))
+            total -= nbytes
+        self._conn.executemany("DELETE FROM entries WHERE cache_key = ?", stale)
+        self._conn.commit()
+        self.evictions += len(stale)
+
+    def report(self) -> Optional[str]:
+        lookups = self.hits + self.misses
+        if not lookups:
+            return None
+        return (f"Detection cache: {self.hits} hits, {self.misses} misses "
+                f"({self.hits / lookups * 100:.1f}% hit rate), {self.evictions} evicted")
+
+    def close(self):
+        self._conn.close()
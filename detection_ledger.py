@@ -0,0 +1,90 @@
+import os
+import time
+import sqlite3
+import threading
+from typing import Iterable, Optional, Tuple
+
+from download_manifest import file_sha256
+
+
+LEDGER_FILE = "detection_ledger.sqlite"
+
+CREATE_COMPLETED_TABLE = """
+CREATE TABLE IF NOT EXISTS completed (
+    file_name TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    weights_hash TEXT NOT NULL,
+    size INTEGER,
+    mtime_ns INTEGER,
+    completed_at REAL,
+    PRIMARY KEY (file_name, content_hash, weights_hash)
+);
+"""
+
+
+class CompletionLedger:
+    """
+    SQLite record of media whose detection rows are committed, keyed by file name, content hash
+    and model weights hash, so an interrupted run restarts where it stopped.
+    Size and mtime are stored too: an unchanged file is recognised without hashing it again.
+    Safe to share with the DB writer thread, which checkpoints items as their rows are committed.
+    """
+
+    def __init__(self, path: str, weights_path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self.weights_hash = file_sha256(weights_path)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(CREATE_COMPLETED_TABLE)
+        self._conn.commit()
+
+    def key_for(self, media_path: str) -> Tuple[str, str, int, int]:
+        """(file_name, content_hash, size, mtime_ns), reusing the recorded hash when size and mtime match."""
+        file_name = os.path.basename(media_path)
+        stat = os.stat(media_path)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content_hash FROM completed WHERE file_name = ? AND size = ? AND mtime_ns = ?",
+                (file_name, stat.st_size, stat.st_mtime_ns),
+            ).fetchone()
+        content_hash = row[0] if row else file_sha256(media_path)
+        return file_name, content_hash, stat.st_size, stat.st_mtime_ns
+
+    def is_done(self, key: Tuple[str, str, int, int]) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM completed WHERE file_name = ? AND content_hash = ? AND weights_hash = ?",
+                (key[0], key[1], self.weights_hash),
+            ).fetchone()
+        return row is not None
+
+    def mark_done(self, keys: Iterable[Tuple[str, str, int, int]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO completed (file_name, content_hash, weights_hash, size, mtime_ns, completed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                [(file_name, content_hash, self.weights_hash, size, mtime_ns, now)
+                 for file_name, content_hash, size, mtime_ns in keys],
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def pending_media(ledger: Optional[CompletionLedger], folder: str, file_names: list, force: bool = False):
+    """
+    Split file_names into the ones still to process, as (file_name, ledger key) pairs, and the number skipped.
+    Without a ledger, or with force, nothing is skipped (keys are still computed so the run is checkpointed).
+    """
+    todo, skipped = [], 0
+    for file_name in file_names:
+        key = ledger.key_for(os.path.join(folder, file_name)) if ledger else None
+        if ledger and not force and ledger.is_done(key):
+            skipped += 1
+            continue
+        todo.append((file_name, key))
+    return todo, skipped
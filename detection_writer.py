@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import queue
+import threading
+from typing import Callable, Iterable, List, Tuple
+
+from result_sinks import ResultSink, TABLE_COLUMNS, make_sink
+
+
+# ---------- Flush policy ----------
+DB_FLUSH_SIZE = 500        # rows per INSERT statement / transaction
+DB_FLUSH_INTERVAL = 5.0    # seconds a row may wait in the buffer before a flush
+DB_QUEUE_SIZE = 256        # media items waiting for the background writer before producers block
+SPILL_PATH = "db_spill.jsonl"  # failed batches are appended here for replay_spill()
+
+
+def spill_rows(spill_path: str, table: str, rows: List[Tuple]):
+    """Append rows that could not be written to a JSONL file, one row per line."""
+    with open(spill_path, "a", encoding="utf-8") as f:
+        for values in rows:
+            f.write(json.dumps({"table": table, "values": list(values)},
+                               default=lambda o: o.item() if hasattr(o, "item") else str(o)) + "\n")
+
+
+class BulkInsertWriter:
+    """
+    Buffers detection rows for one table and writes them to a result sink in bulk
+    (a multi-row INSERT for MySQL), so a flush is one round trip and one commit instead of one per row.
+    A flush happens when flush_size rows are buffered, when the oldest row is older than
+    flush_interval seconds (checked on add), or when flush()/close() is called.
+    Batches that fail are appended to spill_path (if set) instead of being lost.
+    Keys given to add_many() are passed to on_committed once every row added before them is written
+    (or spilled), which is how the completion ledger checkpoints media items.
+    """
+
+    def __init__(self, table: str, flush_size: int = DB_FLUSH_SIZE, flush_interval: float = DB_FLUSH_INTERVAL,
+                 specific_config='default', spill_path: str = None, sink: ResultSink = None,
+                 on_committed: Callable[[list], None] = None):
+        if table not in TABLE_COLUMNS:
+            raise ValueError(f"Unknown detection table: {table}")
+        self.table = table
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.specific_config = specific_config
+        self.sink = sink or make_sink(None, specific_config)
+        self.spill_path = spill_path
+        self.on_committed = on_committed
+        self.rows: List[Tuple] = []
+        self.pending_keys = []
+        self.first_row_time = None
+        self.rows_written = 0
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows_spilled = 0
+
+    def add(self, values: Tuple):
+        if len(values) != len(TABLE_COLUMNS[self.table]):
+            raise ValueError(f"Expected {len(TABLE_COLUMNS[self.table])} values for {self.table}, got {len(values)}")
+        if not self.rows:
+            self.first_row_time = time.time()
+        self.rows.append(values)
+        if len(self.rows) >= self.flush_size or time.time() - self.first_row_time >= self.flush_interval:
+            self.flush()
+
+    def add_many(self, rows: Iterable[Tuple], key=None):
+        for values in rows:
+            self.add(values)
+        if key is not None:
+            self.pending_keys.append(key)
+
+    def flush(self) -> int:
+        """Write the buffered rows in chunks of flush_size; returns the number of rows written."""
+        written = 0
+        lost = False
+        while self.rows:
+            batch, self.rows = self.rows[:self.flush_size], self.rows[self.flush_size:]
+            start = time.time()
+            try:
+                self.sink.write_rows(self.table, batch)
+                written += len(batch)
+            except Exception as e:
+                print(f"Bulk write of {len(batch)} rows into {self.table} ({self.sink.name}) failed: {e}")
+                if self.spill_path:
+                    spill_rows(self.spill_path, self.table, batch)
+                    self.rows_spilled += len(batch)
+                    print(f"Spilled {len(batch)} rows to {self.spill_path}")
+                else:
+                    lost = True
+            self.db_time += time.time() - start
+            self.statements += 1
+        self.rows_written += written
+        self.first_row_time = None
+        keys, self.pending_keys = self.pending_keys, []
+        if keys and self.on_committed:
+            if lost:
+                print(f"{len(keys)} media items not checkpointed: some of their rows were lost")
+            else:
+                self.on_committed(keys)
+        return written
+
+    def close(self):
+        self.flush()
+        print(f"{self.table}: {self.rows_written} rows written in {self.statements} statements"
+              f" ({self.db_time:.2f}s in {self.sink.name}, {self.rows_spilled} spilled)")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class AsyncDetectionWriter:
+    """
+    Background thread owning one BulkInsertWriter per table, so inference never waits on the sink.
+    Producers submit() the rows of one media item; the bounded queue blocks them when the
+    writer falls behind (backpressure). flush() asks for a flush without waiting for it,
+    close() drains the queue, flushes everything and closes the sink. Failed batches are spilled to spill_path.
+    sink is a ResultSink or a make_sink() spec ("mysql", "sqlite:<file>", "csv:<folder>", "parquet:<folder>").
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, flush_size: int = DB_FLUSH_SIZE, flush_interval: float = DB_FLUSH_INTERVAL,
+                 specific_config='default', queue_size: int = DB_QUEUE_SIZE, spill_path: str = SPILL_PATH,
+                 sink=None, on_committed: Callable[[list], None] = None):
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.specific_config = specific_config
+        self.sink = make_sink(sink, specific_config)
+        self.on_committed = on_committed
+        self.spill_path = spill_path
+        self.writers = {}
+        self.blocked_time = 0.0
+        self._queue = queue.Queue(maxsize=max(1, queue_size))
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def _writer_for(self, table: str) -> BulkInsertWriter:
+        if table not in self.writers:
+            self.writers[table] = BulkInsertWriter(table, self.flush_size, self.flush_interval,
+                                                   specific_config=self.specific_config, spill_path=self.spill_path,
+                                                   sink=self.sink, on_committed=self.on_committed)
+        return self.writers[table]
+
+    def _run(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                item = self._FLUSH  # idle: do not leave rows waiting longer than flush_interval
+            if item is self._STOP:
+                break
+            try:
+                if item is self._FLUSH:
+                    for writer in self.writers.values():
+                        writer.flush()
+                    continue
+                table, rows, key = item
+                self._writer_for(table).add_many(rows, key)
+            except Exception as e:
+                print(f"DB writer error: {e}")  # keep the thread alive so producers never block forever
+        for writer in self.writers.values():
+            writer.close()
+        self.sink.close()
+
+    def submit(self, table: str, rows: List[Tuple], key=None):
+        """Queue the rows of one media item; key (if any) is checkpointed once they are committed."""
+        if not rows and key is None:
+            return
+        start = time.time()
+        self._queue.put((table, list(rows), key))
+        self.blocked_time += time.time() - start
+
+    def flush(self):
+        self._queue.put(self._FLUSH)
+
+    def close(self):
+        self._queue.put(self._STOP)
+        self._thread.join()
+        if self.blocked_time > 0.5:
+            print(f"Producers waited {self.blocked_time:.2f}s on the DB writer queue")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def replay_spill(spill_path: str = SPILL_PATH, specific_config='default', flush_size: int = DB_FLUSH_SIZE, sink=None):
+    """Re-insert rows spilled by failed flushes; rows that fail again are kept in the spill file."""
+    if not os.path.exists(spill_path):
+        print(f"No spill file at {spill_path}")
+        return
+    rows_by_table = {}
+    with open(spill_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                rows_by_table.setdefault(record["table"], []).append(tuple(record["values"]))
+
+    retry_path = spill_path + ".retry"
+    sink = make_sink(sink, specific_config)
+    for table, rows in rows_by_table.items():
+        writer = BulkInsertWriter(table, flush_size, float("inf"), specific_config=specific_config,
+                                  spill_path=retry_path, sink=sink)
+        writer.add_many(rows)
+        writer.close()
+    sink.close()
+
+    if os.path.exists(retry_path):
+        os.replace(retry_path, spill_path)
+        print(f"Some rows failed again and remain in {spill_path}")
+    else:
+        os.remove(spill_path)
+        print(f"Replayed {sum(len(rows) for rows in rows_by_table.values())} spilled rows")
@@ -0,0 +1,132 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Any, Dict, Optional
+
+
+CREATE_MEDIA_TABLE = """
+CREATE TABLE IF NOT EXISTS media (
+    url TEXT PRIMARY KEY,
+    target_path TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    updated_at REAL
+);
+"""
+
+CREATE_FAILURES_TABLE = """
+CREATE TABLE IF NOT EXISTS failures (
+    url TEXT PRIMARY KEY,
+    target_path TEXT NOT NULL,
+    http_status INTEGER,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_retry_at REAL,
+    permanent INTEGER NOT NULL DEFAULT 0,
+    alternate_tried INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL
+);
+"""
+
+
+def file_sha256(path: str, chunk_size: int = 1024 * 1024) -> str:
+    """Hash a file in chunks so large videos are never fully loaded in memory."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class DownloadManifest:
+    """
+    Per-study SQLite record of downloaded media, keyed by URL.
+    Stores where each file was saved, its size, the server validators (ETag / Last-Modified)
+    and a content hash, so re-runs can skip unchanged media.
+    A second table is the failure ledger: HTTP status, attempt count and next retry time per failed URL.
+    Safe to share between the download worker threads.
+    """
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute(CREATE_MEDIA_TABLE)
+        self._conn.execute(CREATE_FAILURES_TABLE)
+        self._conn.commit()
+
+    def get(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM media WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def record(self, url: str, target_path: str, size: int, etag: str = None,
+               last_modified: str = None, content_hash: str = None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO media (url, target_path, size, etag, last_modified, content_hash, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (url, target_path, size, etag, last_modified, content_hash, time.time()),
+            )
+            self._conn.execute("DELETE FROM failures WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def relocate(self, url: str, new_path: str):
+        """Follow a file that was moved after download (e.g. into videos_to_be_cut)."""
+        with self._lock:
+            self._conn.execute("UPDATE media SET target_path = ?, updated_at = ? WHERE url = ?",
+                               (new_path, time.time(), url))
+            self._conn.commit()
+
+    # ---------- Failure ledger ----------
+    def get_failure(self, url: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM failures WHERE url = ?", (url,)).fetchone()
+        return dict(row) if row else None
+
+    def record_failure(self, url: str, target_path: str, http_status: Optional[int], error: str,
+                       attempts: int, next_retry_at: Optional[float], permanent: bool):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO failures (url, target_path, http_status, error, attempts, next_retry_at, permanent, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(url) DO UPDATE SET target_path = excluded.target_path, http_status = excluded.http_status,"
+                " error = excluded.error, attempts = excluded.attempts, next_retry_at = excluded.next_retry_at,"
+                " permanent = excluded.permanent, updated_at = excluded.updated_at",
+                (url, target_path, http_status, error, attempts, next_retry_at, int(permanent), time.time()),
+            )
+            self._conn.commit()
+
+    def mark_alternate_tried(self, url: str):
+        with self._lock:
+            self._conn.execute("UPDATE failures SET alternate_tried = 1, updated_at = ? WHERE url = ?",
+                               (time.time(), url))
+            self._conn.commit()
+
+    def clear_failure(self, url: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM failures WHERE url = ?", (url,))
+            self._conn.commit()
+
+    def failures(self) -> list:
+        with self._lock:
+            rows = self._conn.execute("SELECT * FROM failures ORDER BY next_retry_at").fetchall()
+        return [dict(row) for row in rows]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def is_on_disk(entry: Optional[Dict[str, Any]]) -> bool:
+    """True when the manifest entry's file still exists with the recorded size."""
+    if not entry:
+        return False
+    path = entry["target_path"]
+    return os.path.exists(path) and os.path.getsize(path) == entry["size"]
@@ -1,16 +1,478 @@
 import os
 import cv2
+import json
 import time
+import queue
+import random
 import shutil
+import threading
 import requests
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED
+from requests.adapters import HTTPAdapter
 from urllib.parse import urlparse
 
+from download_manifest import DownloadManifest, file_sha256, is_on_disk
+from link_construct import link_folder
+from video_proxy import make_proxy
 
-def download_images_for_study(study_id: str, purpose: str = "dataset"):
+
+# ---------- CONFIG ----------
+
+MAX_WORKERS = 16
+
+# Per-host limits, matched on the end of the host name: (max concurrent requests, max requests per second)
+HOST_LIMITS = {
+    "amazonaws.com": (16, 50.0),
+    "twimg.com": (4, 8.0),
+}
+DEFAULT_HOST_LIMIT = (4, 10.0)
+
+CHUNK_SIZE = 1024 * 1024  # bytes held in memory per worker while streaming
+RESUME_ATTEMPTS = 3       # Range-resume attempts after a dropped connection
+
+# Retry scheduling for the failure ledger
+MAX_RETRY_ATTEMPTS = 6
+RETRY_BASE_DELAY = 60.0        # seconds before the first retry, doubled after each failure
+RETRY_MAX_DELAY = 6 * 3600.0
+TRANSIENT_HTTP_STATUS = {408, 425, 429}  # 4xx codes worth retrying, on top of every 5xx
+ALTERNATE_EXTENSIONS = {".mp4": ".jpg"}  # probed with HEAD when a URL is permanently dead
+
+EXTRACT_WORKERS = 4      # frame-extraction threads fed by the download workers (dataset mode)
+EXTRACT_QUEUE_SIZE = 8   # downloaded videos waiting for extraction before downloads are paused
+
+
+
+# ---------- HTTP ENGINE ----------
+
+def make_session(pool_size: int = MAX_WORKERS) -> requests.Session:
+    """Create a session whose keep-alive connection pool is shared by all download workers."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=len(HOST_LIMITS) + 1, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HostLimiter:
+    """Bounds concurrency and request rate per host, so S3 and the Twitter CDN get different limits."""
+
+    def __init__(self, limits: dict = None, default_limit: tuple = DEFAULT_HOST_LIMIT):
+        self.limits = HOST_LIMITS if limits is None else limits
+        self.default_limit = default_limit
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_slot = {}
+
+    def limit_for(self, host: str) -> tuple:
+        for suffix, limit in self.limits.items():
+            if host == suffix or host.endswith("." + suffix):
+                return limit
+        return self.default_limit
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urlparse(url).netloc.split(":")[0]
+        max_concurrent, rate = self.limit_for(host)
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(max_concurrent)
+            semaphore = self._semaphores[host]
+
+        semaphore.acquire()
+        try:
+            if rate:
+                with self._lock:
+                    now = time.monotonic()
+                    start = max(now, self._next_slot.get(host, now))
+                    self._next_slot[host] = start + 1.0 / rate
+                if start > now:
+                    time.sleep(start - now)
+            yield
+        finally:
+            semaphore.release()
+
+
+class DownloadStats:
+    """Thread-safe counters used to report throughput at the end of a run."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.files = 0
+        self.failed = 0
+        self.bytes = 0
+        self.skipped = 0
+        self.start = time.perf_counter()
+        self.end = None
+
+    def add(self, nbytes: int = None):
+        with self._lock:
+            if nbytes is None:
+                self.failed += 1
+            else:
+                self.files += 1
+                self.bytes += nbytes
+
+    def skip(self):
+        with self._lock:
+            self.skipped += 1
+
+    def finish(self):
+        """Freeze the clock, e.g. when later pipeline stages keep running after the last download."""
+        self.end = time.perf_counter()
+
+    def report(self, label: str):
+        elapsed = max((self.end or time.perf_counter()) - self.start, 1e-6)
+        mb = self.bytes / (1024 * 1024)
+        print(f" Throughput ({label}): {self.files} files, {mb:.1f} MB in {elapsed:.1f}s"
+              f" -> {self.files / elapsed:.2f} files/s, {mb / elapsed:.2f} MB/s"
+              f" ({self.skipped} unchanged, {self.failed} failed)")
+
+
+def expected_total_size(resp: requests.Response, offset: int):
+    """Full file size announced by the server (Content-Range total, else offset + Content-Length)."""
+    content_range = resp.headers.get("Content-Range", "")
+    if "/" in content_range:
+        total = content_range.rsplit("/", 1)[1].strip()
+        return int(total) if total.isdigit() else None
+    length = resp.headers.get("Content-Length", "")
+    return offset + int(length) if length.isdigit() else None
+
+
+def read_part_validators(validators_path: str) -> dict:
+    """ETag / Last-Modified of the response a .part file was started from ({} if unknown)."""
+    try:
+        with open(validators_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def discard_part(part_path: str):
+    """Remove a partial download and its validators file, whichever exist."""
+    for path in (part_path, part_path + ".json"):
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def if_range_value(part_validators: dict):
+    """If-Range validator for resuming a .part: its strong ETag, else its Last-Modified date, else None."""
+    etag = part_validators.get("etag")
+    if etag and not etag.startswith("W/"):
+        return etag
+    return part_validators.get("last_modified")
+
+
+def download_to_file(session: requests.Session, limiter: HostLimiter, url: str, target_path: str,
+                     timeout: float, validators: dict = None) -> dict:
+    """
+    Stream one URL to target_path.
+    Data goes to target_path + ".part" in CHUNK_SIZE pieces and is renamed into place once its size
+    matches the announced length. A dropped connection (or a .part left by a previous run) resumes
+    with an HTTP Range request instead of starting over. The validators of the response a .part was
+    started from are kept in target_path + ".part.json" and sent as If-Range, so a remote file that
+    changed in between comes back whole (200) and replaces the .part instead of being appended to it;
+    a .part without validators is downloaded again from the start.
+    validators (a manifest entry) turns the request into a conditional GET using its ETag / Last-Modified.
+    Returns {"size", "etag", "last_modified", "not_modified"}.
+    """
+    part_path = target_path + ".part"
+    validators_path = part_path + ".json"
+    last_error = None
+
+    for _ in range(RESUME_ATTEMPTS):
+        offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        part_validators = read_part_validators(validators_path) if offset else {}
+        if_range = if_range_value(part_validators)
+        if if_range is None:
+            offset = 0
+        headers = {"Accept-Encoding": "identity"}
+        if offset:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = if_range
+        elif validators and os.path.exists(target_path):
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        try:
+            with limiter.slot(url):
+                with session.get(url, headers=headers, timeout=timeout, stream=True) as resp:
+                    if resp.status_code == 416 and offset:
+                        # Stale partial file that no longer fits the remote one: start again
+                        discard_part(part_path)
+                        last_error = IOError(f"range not satisfiable at byte {offset}")
+                        continue
+                    if resp.status_code == 304:
+                        return {"size": os.path.getsize(target_path), "etag": resp.headers.get("ETag"),
+                                "last_modified": resp.headers.get("Last-Modified"), "not_modified": True}
+                    resp.raise_for_status()
+                    if offset and resp.status_code != 206:
+                        offset = 0  # remote file changed (If-Range) or Range ignored: full body follows
+                    expected = expected_total_size(resp, offset)
+                    etag = resp.headers.get("ETag") or part_validators.get("etag")
+                    last_modified = resp.headers.get("Last-Modified") or part_validators.get("last_modified")
+                    if not offset:
+                        with open(validators_path, "w") as f:
+                            json.dump({"etag": etag, "last_modified": last_modified}, f)
+                    with open(part_path, "ab" if offset else "wb") as f:
+                        for chunk in resp.iter_content(chunk_size=CHUNK_SIZE):
+                            f.write(chunk)
+        except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) as ex:
+            last_error = ex
+            continue
+
+        size = os.path.getsize(part_path)
+        if expected is not None and size != expected:
+            if size > expected:
+                discard_part(part_path)
+            last_error = IOError(f"size mismatch for {url}: got {size} bytes, expected {expected}")
+            continue
+
+        os.replace(part_path, target_path)
+        discard_part(part_path)
+        return {"size": size, "etag": etag, "last_modified": last_modified, "not_modified": False}
+
+    raise last_error
+
+
+def classify_failure(ex: Exception) -> tuple:
+    """Return (http_status, permanent): 5xx, 408/425/429, timeouts and dropped connections are transient."""
+    response = getattr(ex, "response", None)
+    http_status = response.status_code if response is not None else None
+    if http_status is None:
+        return None, False
+    permanent = http_status < 500 and http_status not in TRANSIENT_HTTP_STATUS
+    return http_status, permanent
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter: half the capped delay is fixed, the other half random."""
+    delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def record_failure(manifest: DownloadManifest, url: str, target_path: str, ex: Exception):
+    """Add one attempt to the URL's ledger entry and schedule its next retry."""
+    http_status, permanent = classify_failure(ex)
+    previous = manifest.get_failure(url)
+    attempts = (previous["attempts"] if previous else 0) + 1
+    next_retry_at = None if permanent else time.time() + retry_delay(attempts)
+    manifest.record_failure(url, target_path, http_status, str(ex), attempts, next_retry_at, permanent)
+
+
+def alternate_url(url: str):
+    """Same URL with its extension swapped according to ALTERNATE_EXTENSIONS, or None."""
+    path = urlparse(url).path
+    for ext, alternate in ALTERNATE_EXTENSIONS.items():
+        if path.endswith(ext):
+            return url.replace(path, path[:-len(ext)] + alternate, 1)
+    return None
+
+
+def head_ok(session: requests.Session, limiter: HostLimiter, url: str, timeout: float) -> bool:
+    """Cheap existence check before committing to a full GET."""
+    try:
+        with limiter.slot(url):
+            resp = session.head(url, timeout=timeout, allow_redirects=True)
+        return resp.status_code == 200
+    except requests.RequestException:
+        return False
+
+
+def download_many(jobs: list, timeout: float, error_log: list, max_workers: int = MAX_WORKERS,
+                  stats: DownloadStats = None, session: requests.Session = None, limiter: HostLimiter = None,
+                  manifest: DownloadManifest = None, revalidate: bool = False):
+    """
+    Download (url, target_path) jobs concurrently over one pooled session.
+    Yields (url, target_path, status) as jobs complete, status being "downloaded", "skipped" or "failed";
+    failures are appended to error_log.
+    With a manifest, media already on disk with its recorded size is skipped without any request,
+    or checked with a conditional GET when revalidate is True. Files found on disk but missing
+    from the manifest (earlier runs) are adopted instead of downloaded again.
+    Failures go to the manifest's failure ledger, and URLs it marks as permanently dead are not requested.
+    Jobs are submitted lazily (at most 2 * max_workers in flight), so a consumer that stops iterating
+    also pauses the downloads.
+    """
+    stats = stats or DownloadStats()
+    session = session or make_session(max_workers)
+    limiter = limiter or HostLimiter()
+
+    def worker(url, target_path):
+        entry = manifest.get(url) if manifest else None
+        if entry and is_on_disk(entry):
+            target_path = entry["target_path"]
+            if not revalidate:
+                stats.skip()
+                return target_path, "skipped"
+        elif manifest and os.path.exists(target_path):
+            manifest.record(url, target_path, os.path.getsize(target_path),
+                            content_hash=file_sha256(target_path))
+            stats.skip()
+            return target_path, "skipped"
+        else:
+            entry = None
+            failure = manifest.get_failure(url) if manifest else None
+            if failure and failure["permanent"]:
+                stats.add(None)
+                return target_path, "failed"
+
+        try:
+            info = download_to_file(session, limiter, url, target_path, timeout, validators=entry)
+        except Exception as ex:
+            stats.add(None)
+            error_log.append(f"FAILED: {url} -> {target_path}, error: {ex}")
+            if manifest:
+                record_failure(manifest, url, target_path, ex)
+            return target_path, "failed"
+
+        if info["not_modified"]:
+            stats.skip()
+            return target_path, "skipped"
+
+        stats.add(info["size"])
+        if manifest:
+            manifest.record(url, target_path, info["size"], info["etag"], info["last_modified"],
+                            file_sha256(target_path))
+        print(f" Saved: {os.path.abspath(target_path)}")
+        return target_path, "downloaded"
+
+    max_in_flight = 2 * max(1, max_workers)
+    pending_jobs = iter(jobs)
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while True:
+            for url, target_path in pending_jobs:
+                in_flight[pool.submit(worker, url, target_path)] = url
+                if len(in_flight) >= max_in_flight:
+                    break
+            if not in_flight:
+                break
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                target_path, status = future.result()
+                yield in_flight.pop(future), target_path, status
+
+
+def build_download_jobs(link_file: str, source: str, study_id: str, target_folder: str, ext: str) -> list:
+    """Read a links file and return (url, target_path) pairs named like the rest of the pipeline expects."""
+    jobs = []
+    if not os.path.exists(link_file):
+        return jobs
+    with open(link_file, "r") as f:
+        for line in f:
+            url = line.strip()
+            if not url:
+                continue
+            if source == "aws":
+                filename_base = url.split('/')[-1]
+                base = filename_base.rsplit('.', 1)[0]
+                filename = f"{study_id}_{base}.{ext}"
+            else:
+                parsed = urlparse(url)
+                pub_id = parsed.path.rstrip('/').split('/')[-1]
+                filename = f"{study_id}_{pub_id}_3.{ext}"
+            jobs.append((url, os.path.join(target_folder, filename)))
+    return jobs
+
+
+# ---------- FRAME SAMPLING ----------
+
+def extract_sampled_frames(cap, output_folder: str, base_name: str, sample_rate: int) -> tuple:
+    """
+    Save every sample_rate-th frame as {base_name}-NNNNN.jpg, the same frames a full cap.read() loop keeps.
+    Every frame is grab()bed (demuxed and decoded); only the saved ones are retrieve()d (converted to BGR).
+    Returns (saved_frames, estimated BGR conversion seconds skipped versus reading every frame);
+    decoding itself is not skipped, since grab() still decodes each frame.
+    """
+    saved_frames = 0
+    skipped_frames = 0
+    grab_time = 0.0
+    convert_time = 0.0
+    frame_idx = 0
+    while True:
+        start = time.perf_counter()
+        ret = cap.grab()
+        grab_time += time.perf_counter() - start
+        if not ret:
+            break
+        if frame_idx % sample_rate == 0:
+            start = time.perf_counter()
+            ret, frame = cap.retrieve()
+            convert_time += time.perf_counter() - start
+            if not ret:
+                break
+            cv2.imwrite(os.path.join(output_folder, f"{base_name}-{saved_frames:05d}.jpg"), frame)
+            saved_frames += 1
+        else:
+            skipped_frames += 1
+        frame_idx += 1
+
+    if frame_idx:
+        print(f" grab (decode): {grab_time:.2f}s for {frame_idx} frames,"
+              f" retrieve (BGR): {convert_time:.2f}s for {saved_frames} frames")
+    time_saved = skipped_frames * convert_time / saved_frames if saved_frames else 0.0
+    return saved_frames, time_saved
+
+
+def process_dataset_video(url: str, video_path: str, dataset_folder: str, cut_folder: str, frame_threshold: int,
+                          manifest: DownloadManifest, error_log: list) -> tuple:
+    """
+    Dataset step for one downloaded video: extract ~5% of the frames of a short video,
+    or move a long one to cut_folder. Returns (saved_frames, BGR conversion seconds skipped).
+    """
+    out_name = os.path.basename(video_path)
+    cap = None
+    try:
+        cap = cv2.VideoCapture(video_path)
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        duration_sec = total_frames / fps if fps else 0
+
+        print(f"\n Video: {video_path}\nFPS: {fps:.2f}, Frames: {total_frames}, Duration: {duration_sec:.1f}s")
+
+        if total_frames <= frame_threshold and fps > 0:
+            base_name = os.path.splitext(out_name)[0]
+            sample_rate = max(1, total_frames // max(1, total_frames // 20))
+            saved_frames, time_saved = extract_sampled_frames(cap, dataset_folder, base_name, sample_rate)
+            print(f" Extracted {saved_frames} frames (~5%) from {out_name}"
+                  f" (~{time_saved:.2f}s of BGR conversion skipped)")
+            return saved_frames, time_saved
+
+        # Move long videos to cut folder (the capture is released first so the file is not locked)
+        cap.release()
+        cap = None
+        dest_path = os.path.join(cut_folder, out_name)
+        if os.path.abspath(dest_path) == os.path.abspath(video_path):
+            # already in cut_folder (e.g. a revalidated download of a long video moved by an earlier run)
+            return 0, 0.0
+        try:
+            if os.path.exists(dest_path):
+                os.remove(dest_path)
+            shutil.move(video_path, dest_path)
+            manifest.relocate(url, dest_path)
+            print(f" Moved long video to videos_to_be_cut: {out_name}")
+        except Exception as move_ex:
+            error_log.append(f"ERROR moving video {video_path}: {move_ex}")
+
+    except Exception as ex:
+        error_log.append(f"ERROR processing video {video_path}: {ex}")
+    finally:
+        if cap is not None:
+            cap.release()
+    return 0, 0.0
+
+
+def download_images_for_study(study_id: str, purpose: str = "dataset", max_workers: int = MAX_WORKERS,
+                              revalidate: bool = False):
     """
     Downloads images for a study.
     - If purpose == "dataset": behaves normally, saves images in datasets/dataset_{id}/
     - If purpose == "media_analysis": saves images in media_for_detection_{id}/images/
+    Downloads run concurrently on max_workers threads (1 = sequential).
+    Images already listed in the folder's manifest_{id}.sqlite are skipped; revalidate=True
+    checks them against the server with conditional requests instead.
     """
 
     # Define target folder based on purpose
@@ -21,54 +483,27 @@ def download_images_for_study(study_id: str, purpose: str = "dataset"):
 
     os.makedirs(dataset_folder, exist_ok=True)
 
-    image_folder = f"images_{study_id}"
+    image_folder = link_folder("images", study_id)
     aws_file = os.path.join(image_folder, "aws_links.txt")
     twitter_file = os.path.join(image_folder, "twitter_links.txt")
 
     error_log = []
     total_downloaded = 0
+    stats = DownloadStats()
 
-    def download_and_save(url, target_path):
-        try:
-            resp = requests.get(url, timeout=15)
-            resp.raise_for_status()
-            with open(target_path, 'wb') as f:
-                f.write(resp.content)
-            print(f" Saved: {os.path.abspath(target_path)}")
-            return True
-        except Exception as ex:
-            error_log.append(f"FAILED: {url} -> {target_path}, error: {ex}")
-            return False
-
-    # --- Download from AWS file ---
-    if os.path.exists(aws_file):
-        with open(aws_file, "r") as f:
-            for line in f:
-                url = line.strip()
-                if not url:
-                    continue
-                filename_base = url.split('/')[-1]
-                base = filename_base.rsplit('.', 1)[0]
-                filename = f"{study_id}_{base}.jpg"
-                target_path = os.path.join(dataset_folder, filename)
-                if download_and_save(url, target_path):
-                    total_downloaded += 1
-
-    # --- Download from Twitter file ---
-    if os.path.exists(twitter_file):
-        with open(twitter_file, "r") as f:
-            for line in f:
-                url = line.strip()
-                if not url:
-                    continue
-                parsed = urlparse(url)
-                pub_id = parsed.path.rstrip('/').split('/')[-1]
-                filename = f"{study_id}_{pub_id}_3.jpg"
-                target_path = os.path.join(dataset_folder, filename)
-                if download_and_save(url, target_path):
-                    total_downloaded += 1
+    manifest = DownloadManifest(os.path.join(dataset_folder, f"manifest_{study_id}.sqlite"))
+
+    jobs = build_download_jobs(aws_file, "aws", study_id, dataset_folder, "jpg")
+    jobs += build_download_jobs(twitter_file, "twitter", study_id, dataset_folder, "jpg")
+
+    for _, _, status in download_many(jobs, timeout=15, error_log=error_log, max_workers=max_workers,
+                                      stats=stats, manifest=manifest, revalidate=revalidate):
+        if status == "downloaded":
+            total_downloaded += 1
+    manifest.close()
 
     print(f"\n Downloaded {total_downloaded} images for study {study_id} over month 10")
+    stats.report("images")
 
     if error_log:
         error_logfile = os.path.join(dataset_folder, f"errors_{study_id}.log")
@@ -79,27 +514,38 @@ def download_images_for_study(study_id: str, purpose: str = "dataset"):
         print(f" Some downloads failed. Check {error_logfile} for details.")
 
 
-def download_and_process_videos(study_id: str, purpose: str = "dataset", frame_threshold: int = 150):
+def download_and_process_videos(study_id: str, purpose: str = "dataset", frame_threshold: int = 150,
+                                max_workers: int = MAX_WORKERS, revalidate: bool = False,
+                                extract_workers: int = EXTRACT_WORKERS, make_proxies: bool = False,
+                                imgsz: int = 640):
     """
     Downloads videos for a study.
     - If purpose == "dataset": keeps full logic (frame extraction + moving long videos)
     - If purpose == "media_analysis": downloads only videos (no frame extraction)
       into media_for_detection_{id}/videos/
+    Downloads run concurrently on max_workers threads and hand finished videos, through a bounded queue,
+    to extract_workers frame-extraction threads, so downloading and decoding overlap.
+    Videos already listed in the folder's manifest_{id}.sqlite are neither downloaded nor processed again.
+    With make_proxies=True, the same workers also transcode each video once into a low-resolution
+    analysis proxy (long side ~imgsz, no audio, short GOP) in videos_proxy/, next to a .proxy.json
+    sidecar holding the original-to-proxy scale factors.
     """
 
     # Define folders based on purpose
     if purpose == "dataset":
         dataset_folder = f"datasets/dataset_{study_id}"
         cut_folder = os.path.join(dataset_folder, "videos_to_be_cut")
+        proxy_folder = os.path.join(dataset_folder, "videos_proxy")
     else:
         dataset_folder = os.path.join(f"media_detection_{study_id}", "videos")
         cut_folder = None  # not used
+        proxy_folder = os.path.join(f"media_detection_{study_id}", "videos_proxy")
 
     os.makedirs(dataset_folder, exist_ok=True)
     if cut_folder:
         os.makedirs(cut_folder, exist_ok=True)
 
-    video_folder = f"videos_{study_id}_10" # 10 correspond au mois de l'année sur lequel la requete de link construct est lancée
+    video_folder = link_folder("videos", study_id)  # same suffix as link_construct.FOLDER_SUFFIX
     video_files = {
         "aws": os.path.join(video_folder, "aws_links.txt"),
         "twitter": os.path.join(video_folder, "twitter_links.txt"),
@@ -108,104 +554,69 @@ def download_and_process_videos(study_id: str, purpose: str = "dataset", frame_t
     error_log = []
     total_downloaded = 0
     processed_frames = 0
+    total_time_saved = 0.0
+    stats = DownloadStats()
 
-    def download_and_save(url, target_path):
-        try:
-            resp = requests.get(url, timeout=30)
-            resp.raise_for_status()
-            with open(target_path, 'wb') as f:
-                f.write(resp.content)
-            print(f" Saved: {os.path.abspath(target_path)}")
-            return True
-        except Exception as ex:
-            error_log.append(f"FAILED: {url} -> {target_path}, error: {ex}")
-            return False
+    manifest = DownloadManifest(os.path.join(dataset_folder, f"manifest_{study_id}.sqlite"))
 
+    jobs = []
     for source, file_path in video_files.items():
-        if not os.path.exists(file_path):
-            continue
-
-        with open(file_path, "r") as f:
-            for line in f:
-                url = line.strip()
-                if not url:
-                    continue
-
-                if source == "aws":
-                    filename_base = url.split('/')[-1]
-                    base = filename_base.rsplit('.', 1)[0]
-                    out_name = f"{study_id}_{base}.mp4"
-                else:
-                    parsed = urlparse(url)
-                    pub_id = parsed.path.rstrip('/').split('/')[-1]
-                    out_name = f"{study_id}_{pub_id}_3.mp4"
-
-                video_path = os.path.join(dataset_folder, out_name)
-
-                if not download_and_save(url, video_path):
-                    continue
-
-                total_downloaded += 1
-
-                # --- If purpose == "media_analysis", skip all processing ---
-                if purpose != "dataset":
-                    continue
-
-                # --- Dataset processing logic ---
-                cap = None
+        jobs += build_download_jobs(file_path, source, study_id, dataset_folder, "mp4")
+
+    # --- Extraction workers (dataset mode and/or proxies) consume videos as soon as they are downloaded ---
+    video_queue = queue.Queue(maxsize=EXTRACT_QUEUE_SIZE)
+    totals_lock = threading.Lock()
+    extract_busy = 0.0
+
+    def extraction_worker():
+        nonlocal processed_frames, total_time_saved, extract_busy
+        while True:
+            item = video_queue.get()
+            if item is None:
+                return
+            start = time.perf_counter()
+            if make_proxies:
                 try:
-                    cap = cv2.VideoCapture(video_path)
-                    fps = cap.get(cv2.CAP_PROP_FPS)
-                    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                    duration_sec = total_frames / fps if fps else 0
-
-                    print(f"\n Video: {video_path}\nFPS: {fps:.2f}, Frames: {total_frames}, Duration: {duration_sec:.1f}s")
-
-                    if total_frames <= frame_threshold and fps > 0:
-                        frame_output_folder = dataset_folder
-                        base_name = os.path.splitext(out_name)[0]
-                        frame_count = 0
-                        saved_frames = 0
-                        sample_rate = max(1, total_frames // max(1, total_frames // 20))
-
-                        while True:
-                            ret, frame = cap.read()
-                            if not ret:
-                                break
-                            if frame_count % sample_rate == 0:
-                                filename = f"{base_name}-{saved_frames:05d}.jpg"
-                                filepath = os.path.join(frame_output_folder, filename)
-                                cv2.imwrite(filepath, frame)
-                                saved_frames += 1
-                            frame_count += 1
-
-                        print(f" Extracted {saved_frames} frames (~5%) from {out_name}")
-                        processed_frames += saved_frames
-                    else:
-                        # Move long videos to cut folder
-                        if cut_folder:
-                            dest_path = os.path.join(cut_folder, out_name)
-                            try:
-                                if os.path.exists(dest_path):
-                                    os.remove(dest_path)
-                                cap.release()
-                                time.sleep(0.1)
-                                shutil.move(video_path, dest_path)
-                                print(f" Moved long video to videos_to_be_cut: {out_name}")
-                                cap = None
-                            except Exception as move_ex:
-                                error_log.append(f"ERROR moving video {video_path}: {move_ex}")
-
+                    if make_proxy(item[1], proxy_folder, imgsz):
+                        print(f" Proxy written for {os.path.basename(item[1])}")
                 except Exception as ex:
-                    error_log.append(f"ERROR processing video {video_path}: {ex}")
-                finally:
-                    if cap is not None:
-                        cap.release()
-                        time.sleep(0.2)
+                    error_log.append(f"ERROR making proxy for {item[1]}: {ex}")
+            saved_frames, time_saved = 0, 0.0
+            if purpose == "dataset":
+                saved_frames, time_saved = process_dataset_video(item[0], item[1], dataset_folder, cut_folder,
+                                                                 frame_threshold, manifest, error_log)
+            with totals_lock:
+                processed_frames += saved_frames
+                total_time_saved += time_saved
+                extract_busy += time.perf_counter() - start
+
+    extractors = []
+    if purpose == "dataset" or make_proxies:
+        extractors = [threading.Thread(target=extraction_worker, daemon=True) for _ in range(max(1, extract_workers))]
+        for t in extractors:
+            t.start()
+
+    for url, video_path, status in download_many(jobs, timeout=30, error_log=error_log, max_workers=max_workers,
+                                                 stats=stats, manifest=manifest, revalidate=revalidate):
+        if status != "downloaded":
+            continue
+        total_downloaded += 1
+        if extractors:
+            video_queue.put((url, video_path))  # blocks when extraction falls behind, pausing downloads
+
+    stats.finish()
+    for _ in extractors:
+        video_queue.put(None)
+    for t in extractors:
+        t.join()
+    manifest.close()
 
     print(f"\nSummary for study {study_id}: {total_downloaded} videos downloaded.")
+    stats.report("videos")
     if purpose == "dataset":
-        print(f"Frames extracted: {processed_frames}")
+        print(f"Frames extracted: {processed_frames} (~{total_time_saved:.2f}s of BGR conversion skipped by grab/retrieve sampling)")
+        print(f"Pipeline: downloads done after {stats.end - stats.start:.1f}s, {extract_busy:.1f}s of extraction"
+              f" on {len(extractors)} workers, wall-clock {time.perf_counter() - stats.start:.1f}s")
 
     if error_log:
         error_logfile = os.path.join(dataset_folder, f"errors_{study_id}.log")
@@ -216,68 +627,73 @@ def download_and_process_videos(study_id: str, purpose: str = "dataset", frame_t
         print(f" Some videos failed. See {error_logfile} for details.")
 
 
-def retry_failed_downloads(study_id: int):
+def retry_failed_downloads(study_id: int, folder: str = None, max_workers: int = MAX_WORKERS, timeout: float = 30):
     """
-    Retry downloads from the error log by replacing .mp4 with .jpg in URLs.
-    Save the images in the same folder as the error log.
+    Retry the failures recorded in the study's manifest ledger (default folder datasets/dataset_{id}).
+    - Transient failures (5xx, 408/429, timeouts) are retried once their backoff delay has passed,
+      up to MAX_RETRY_ATTEMPTS attempts.
+    - Permanent failures (403/404...) are never requested again; for those, the alternate extension
+      (.mp4 -> .jpg) is probed once with HEAD and only downloaded if it exists, next to the original target.
     """
-    # Locate the error log relative to current working directory
-    error_log_path = os.path.join("datasets", f"dataset_{study_id}", f"errors_{study_id}.log")
+    folder = folder or os.path.join("datasets", f"dataset_{study_id}")
+    manifest_path = os.path.join(folder, f"manifest_{study_id}.sqlite")
 
-    if not os.path.exists(error_log_path):
-        print(f"No error log found for study {study_id} at {error_log_path}")
+    if not os.path.exists(manifest_path):
+        print(f"No download manifest found for study {study_id} at {manifest_path}")
         return
 
-    # Folder where the error log is
-    log_folder = os.path.dirname(error_log_path)
-
-    with open(error_log_path, "r") as f:
-        lines = f.readlines()
+    manifest = DownloadManifest(manifest_path)
+    session = make_session(max_workers)
+    limiter = HostLimiter()
+    now = time.time()
+
+    failures = manifest.failures()
+    due = [f for f in failures
+           if not f["permanent"] and f["attempts"] < MAX_RETRY_ATTEMPTS and (f["next_retry_at"] or 0) <= now]
+    to_probe = [f for f in failures if f["permanent"] and not f["alternate_tried"] and alternate_url(f["url"])]
+    waiting = sum(1 for f in failures if not f["permanent"] and f["attempts"] < MAX_RETRY_ATTEMPTS) - len(due)
+
+    # --- Probe alternate extensions of dead URLs with HEAD ---
+    jobs = [(f["url"], f["target_path"]) for f in due]
+    replaces = {}
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        probes = {pool.submit(head_ok, session, limiter, alternate_url(f["url"]), timeout): f for f in to_probe}
+        for future in as_completed(probes):
+            failure = probes[future]
+            manifest.mark_alternate_tried(failure["url"])
+            if future.result():
+                new_url = alternate_url(failure["url"])
+                ext = ALTERNATE_EXTENSIONS[os.path.splitext(urlparse(failure["url"]).path)[1]]
+                new_path = os.path.splitext(failure["target_path"])[0] + ext
+                jobs.append((new_url, new_path))
+                replaces[new_url] = failure["url"]
+
+    print(f"Retrying {len(due)} transient failures and {len(replaces)}/{len(to_probe)} alternate URLs"
+          f" for study {study_id}")
 
-    remaining_lines = []
+    error_log = []
+    stats = DownloadStats()
     total_fixed = 0
-    total_attempts = 0
-
-    for line in lines:
-        if "FAILED:" not in line or "->" not in line:
-            remaining_lines.append(line)
+    for url, target_path, status in download_many(jobs, timeout=timeout, error_log=error_log,
+                                                  max_workers=max_workers, stats=stats, session=session,
+                                                  limiter=limiter, manifest=manifest):
+        if status == "failed":
             continue
+        total_fixed += 1
+        if url in replaces:
+            manifest.clear_failure(replaces[url])
+        print(f"   Saved to: {os.path.abspath(target_path)}")
 
-        total_attempts += 1
-        try:
-            url_part = line.split("FAILED: ")[1].split(" -> ")[0].strip()
-            save_path = line.split("->")[1].split(",")[0].strip()
-        except Exception:
-            remaining_lines.append(line)
-            continue
-
-        # Replace .mp4 with .jpg
-        new_url = url_part.replace(".mp4", ".jpg")
-        # Use same folder as error log
-        filename = os.path.basename(save_path).replace(".mp4", ".jpg")
-        new_save_path = os.path.join(log_folder, filename)
-
-        try:
-            resp = requests.get(new_url, timeout=10)
-            if resp.status_code == 200:
-                with open(new_save_path, "wb") as f:
-                    f.write(resp.content)
-                print(f"   Saved to: {os.path.abspath(new_save_path)}")
-                total_fixed += 1
-            else:
-                print(f" Failed ({resp.status_code}): {new_url}")
-                remaining_lines.append(line)
-        except Exception as e:
-            print(f" Failed ({e}): {new_url}")
-            remaining_lines.append(line)
-
-    # Rewrite remaining failed entries to log
-    with open(error_log_path, "w") as f:
-        f.writelines(remaining_lines)
+    remaining = manifest.failures()
+    manifest.close()
 
-    print(f"\n Retry complete for study {study_id}: {total_fixed}/{total_attempts} fixed successfully.")
+    print(f"\n Retry complete for study {study_id}: {total_fixed}/{len(jobs)} fixed successfully.")
+    print(f" Ledger: {len(remaining)} failures left, {waiting} waiting for their backoff delay,"
+          f" {sum(1 for f in remaining if f['permanent'])} permanent.")
+    stats.report("retry")
 
 
-download_images_for_study("53", purpose="media_analysis")
-#download_and_process_videos("53", purpose="media_analysis")
-#retry_failed_downloads(study_id=53)
\ No newline at end of file
+if __name__ == "__main__":
+    download_images_for_study("53", purpose="media_analysis")
+    #download_and_process_videos("53", purpose="media_analysis")
+    #retry_failed_downloads(study_id=53)
\ No newline at end of file
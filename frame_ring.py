@@ -0,0 +1,116 @@
+import time
+import queue
+import threading
+from typing import Callable, Optional, Tuple
+
+import cv2
+import numpy as np
+
+
+RING_SLOTS = 16  # frame buffers shared by the decoder thread and inference
+
+
+class FrameRing:
+    """
+    Decoder thread reading a video ahead of inference into a bounded ring of preallocated frame buffers.
+    Frames are decoded in place (cap.read(buffer)), so nothing is allocated per frame; the decoder blocks
+    when every buffer is in use. get() returns (frame_idx, frame, slot) in frame order, or None at the end
+    of the video; release(slot) hands the buffer back once the frame is no longer needed.
+    Frames for which wanted(frame_idx) is false are only grabbed and come back as (frame_idx, None, None).
+    first_frame / last_frame (1-based, inclusive) limit reading to a range of the video; frame_idx stays
+    the index in the whole video.
+    decode_time / blocked_time (decoder waiting for a free buffer) and wait_time (consumer waiting for
+    a frame) tell which side is the bottleneck.
+    """
+
+    _END = object()
+
+    def __init__(self, cap: cv2.VideoCapture, slots: int = RING_SLOTS,
+                 wanted: Optional[Callable[[int], bool]] = None, first_frame: int = 1,
+                 last_frame: Optional[int] = None):
+        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        slots = max(1, slots)
+        # unknown size: cap.read() allocates each buffer on first use, later reads reuse it
+        self.buffers = [np.empty((height, width, 3), dtype=np.uint8) if width and height else None
+                        for _ in range(slots)]
+        self.wanted = wanted
+        self.first_frame = max(1, first_frame)
+        self.last_frame = last_frame
+        self.decode_time = self.blocked_time = self.wait_time = 0.0
+        self._cap = cap
+        self._free = queue.Queue()
+        for slot in range(slots):
+            self._free.put(slot)
+        self._ready = queue.Queue()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="frame-decoder", daemon=True)
+        self._thread.start()
+
+    def _next_free_slot(self) -> Optional[int]:
+        start = time.time()
+        try:
+            while not self._stop.is_set():
+                try:
+                    return self._free.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            return None
+        finally:
+            self.blocked_time += time.time() - start
+
+    def _run(self):
+        frame_idx = self.first_frame - 1
+        try:
+            if frame_idx:
+                self._cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            while not self._stop.is_set():
+                frame_idx += 1
+                if self.last_frame is not None and frame_idx > self.last_frame:
+                    break
+                if self.wanted is None or self.wanted(frame_idx):
+                    slot = self._next_free_slot()
+                    if slot is None:
+                        break
+                    start = time.time()
+                    ret, frame = self._cap.read(self.buffers[slot])
+                    self.decode_time += time.time() - start
+                    if not ret:
+                        self._free.put(slot)
+                        break
+                    self.buffers[slot] = frame  # same array unless the frame size changed
+                    self._ready.put((frame_idx, frame, slot))
+                else:
+                    start = time.time()
+                    ret = self._cap.grab()  # frame only needs to be counted, not decoded into an image
+                    self.decode_time += time.time() - start
+                    if not ret:
+                        break
+                    self._ready.put((frame_idx, None, None))
+        except Exception as e:
+            self._ready.put(e)
+        self._ready.put(self._END)
+
+    def get(self) -> Optional[Tuple[int, Optional[np.ndarray], Optional[int]]]:
+        start = time.time()
+        item = self._ready.get()
+        self.wait_time += time.time() - start
+        if item is self._END:
+            self._ready.put(item)  # later calls see the end too
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def release(self, slot: Optional[int]):
+        if slot is not None:
+            self._free.put(slot)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -1,15 +1,39 @@
 import os
+import sys
 import json
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
 from ultralytics import YOLO
-from dc_utils import mysql_execute_insert
+from ultralytics.engine.results import Results
+from detection_writer import AsyncDetectionWriter, BulkInsertWriter, DB_FLUSH_SIZE, DB_FLUSH_INTERVAL, SPILL_PATH
+from result_sinks import make_sink
+from detection_arrays import result_arrays, class_names, size_categories, detections_summary
+from detection_ledger import CompletionLedger, LEDGER_FILE, pending_media
+from detection_cache import DetectionCache, DETECTION_CACHE_FILE
+from download_manifest import file_sha256
+
+# --- Batching ---
+BATCH_SIZE = 8       # images per model call
+DECODE_WORKERS = 4   # threads decoding images ahead of inference
+
+# --- Target table (columns in result_sinks.TABLE_SCHEMAS) ---
+IMAGE_TABLE = "yolo_image_detection"
 
-# --- SQL statement ---
-INSERT_SQL = """
-INSERT INTO yolo_image_detection 
-(study_id, media_id, plateform_id, logo, size, area, areaPercentage, confidence, x1, y1, x2, y2)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-"""
+# --- Outputs ---
+SAVE_ANNOTATED_IMAGES = True  # annotated copy of every image in detections_images
+SAVE_JSON = True              # detection JSON in detection_jsons
+WRITE_DB = True               # rows to the result sink (MySQL by default)
+JSON_FORMAT = "jsonl"         # "jsonl": one compact line per image in <folder>.jsonl, "files": one indented JSON per image
+ARTIFACT_WORKERS = 4          # threads writing annotated images / JSON off the inference thread
+
+# --- Inference settings (part of the detection cache key) ---
+IMGSZ = 640
+CONF = 0.25                   # ultralytics default confidence threshold
+USE_DETECTION_CACHE = True    # reuse boxes of identical images across studies and re-runs (detection_cache.py)
 
 def parse_filename(file_name: str):
     """
@@ -24,58 +48,149 @@ def parse_filename(file_name: str):
     media_id = "_".join(parts[1:-1])
     return study_id, media_id, plateform_id
 
-def insert_yolo_results(file_name: str, results, specific_config='default'):
+def build_detection_rows(file_name: str, orig_shape, xyxy, conf, names: list) -> list:
     """
-    Insert YOLO detection results into the MySQL table.
-    One row per detected object.
+    Build the yolo_image_detection rows of one image, one row per detected object,
+    from the result_arrays() of its YOLO result.
     """
     study_id, media_id, plateform_id = parse_filename(file_name)
-    
-    img_height, img_width = results[0].orig_shape[:2]
-    detections = json.loads(results[0].to_json())  # list of dicts
-
-    for det in detections:
-        name = det['name']
-        confidence = det['confidence']
-        box = det['box']
-        x1 = box['x1']
-        y1 = box['y1']
-        x2 = box['x2']
-        y2 = box['y2']
-
-        width = x2 - x1
-        height = y2 - y1
-        area = width * height
-        area_percentage = area / (img_width * img_height) * 100
-        if area_percentage >= 10.0:
-            size_str = "large"
-        elif area_percentage >= 1.0:
-            size_str = "meduim"
-        elif area_percentage >= 0.1:
-            size_str = "small"
-        else:
-            size_str = "negligeable"
-
-        values = (
-            study_id,
-            media_id,
-            str(plateform_id),
-            name,
-            size_str,
-            area,
-            area_percentage,
-            confidence,
-            x1,
-            y1,
-            x2,
-            y2
-        )
-
-        mysql_execute_insert(INSERT_SQL, values, specific_config=specific_config)
-
-def run_yolo_detections_on_folder(images_folder: str, model_weights_path: str):
+    img_height, img_width = orig_shape[:2]
+
+    areas = (xyxy[:, 2] - xyxy[:, 0]) * (xyxy[:, 3] - xyxy[:, 1])
+    area_percentages = areas / (img_width * img_height) * 100
+    sizes = size_categories(area_percentages, "negligeable")
+
+    return [
+        (study_id, media_id, str(plateform_id), name, size_str, area, area_percentage, confidence, x1, y1, x2, y2)
+        for name, size_str, area, area_percentage, confidence, (x1, y1, x2, y2)
+        in zip(names, sizes, areas.tolist(), area_percentages.tolist(), conf.tolist(), xyxy.tolist())
+    ]
+
+def insert_yolo_results(file_name: str, results, specific_config='default', sink=None):
+    """
+    Insert YOLO detection results into the MySQL table (or another result sink), in one statement for this image.
+    """
+    writer = BulkInsertWriter(IMAGE_TABLE, specific_config=specific_config, sink=make_sink(sink, specific_config))
+    xyxy, conf, cls = result_arrays(results[0])
+    writer.add_many(build_detection_rows(file_name, results[0].orig_shape, xyxy, conf, class_names(results[0], cls)))
+    writer.flush()
+
+def iter_decoded_batches(images_folder: str, image_files: list, batch_size: int = BATCH_SIZE,
+                         decode_workers: int = DECODE_WORKERS):
+    """
+    Decode images on a thread pool, at most two batches ahead of inference,
+    and yield (file_names, images) batches in folder order.
     """
-    Runs YOLO detections on all images in a folder and inserts results into MySQL.
+    prefetch = max(1, batch_size) * 2
+    pending = deque()
+    remaining = iter(image_files)
+
+    with ThreadPoolExecutor(max_workers=max(1, decode_workers)) as pool:
+        def fill():
+            while len(pending) < prefetch:
+                image_file = next(remaining, None)
+                if image_file is None:
+                    return
+                pending.append((image_file, pool.submit(cv2.imread, os.path.join(images_folder, image_file))))
+
+        fill()
+        batch_files, batch_images = [], []
+        while pending:
+            image_file, future = pending.popleft()
+            fill()
+            image = future.result()
+            if image is None:
+                print(f"Could not read image: {image_file}")
+                continue
+            batch_files.append(image_file)
+            batch_images.append(image)
+            if len(batch_files) >= batch_size:
+                yield batch_files, batch_images
+                batch_files, batch_images = [], []
+        if batch_files:
+            yield batch_files, batch_images
+
+
+class ArtifactWriter:
+    """
+    Writes annotated images and detection JSON on background threads, so inference never waits on the disk.
+    Annotated images are rendered by a pool of workers; JSONL lines go through a single thread to keep the
+    file in processing order. At most max_pending items are in flight: a slow disk then holds back
+    inference instead of piling up results in memory.
+    """
+
+    def __init__(self, image_dir: str = None, json_dir: str = None, jsonl_path: str = None,
+                 workers: int = ARTIFACT_WORKERS, max_pending: int = None, jsonl_mode: str = "w"):
+        self.image_dir = image_dir
+        self.json_dir = json_dir
+        self.jsonl_file = open(jsonl_path, jsonl_mode, encoding="utf-8") if jsonl_path else None
+        self.max_pending = max_pending or max(1, workers) * 4
+        self.pool = ThreadPoolExecutor(max_workers=max(1, workers))
+        self.jsonl_pool = ThreadPoolExecutor(max_workers=1)
+        self.pending = deque()
+
+    def _wait(self, limit: int):
+        while len(self.pending) > limit:
+            image_file, future = self.pending.popleft()
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error writing artifacts for {image_file}: {e}")
+
+    def _save_image(self, image_file: str, result):
+        result.save(filename=os.path.join(self.image_dir, image_file))
+
+    def _save_json_file(self, image_file: str, summary: list):
+        json_path = os.path.join(self.json_dir, os.path.splitext(image_file)[0] + ".json")
+        with open(json_path, "w", encoding="utf-8") as jf:
+            json.dump(summary, jf, indent=2, ensure_ascii=False)
+
+    def _append_jsonl(self, image_file: str, summary: list):
+        self.jsonl_file.write(json.dumps({"file": image_file, "detections": summary},
+                                         ensure_ascii=False, separators=(",", ":")) + "\n")
+
+    def submit(self, image_file: str, result, summary: list = None):
+        if self.image_dir:
+            self.pending.append((image_file, self.pool.submit(self._save_image, image_file, result)))
+        if summary is not None and self.jsonl_file:
+            self.pending.append((image_file, self.jsonl_pool.submit(self._append_jsonl, image_file, summary)))
+        elif summary is not None and self.json_dir:
+            self.pending.append((image_file, self.pool.submit(self._save_json_file, image_file, summary)))
+        self._wait(self.max_pending)
+
+    def close(self):
+        self._wait(0)
+        self.pool.shutdown()
+        self.jsonl_pool.shutdown()
+        if self.jsonl_file:
+            self.jsonl_file.close()
+
+
+def list_images(images_folder: str) -> list:
+    return [f for f in os.listdir(images_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+
+
+def run_yolo_detections_on_folder(images_folder: str, model_weights_path: str, batch_size: int = BATCH_SIZE,
+                                  decode_workers: int = DECODE_WORKERS, db_config='default',
+                                  flush_size: int = DB_FLUSH_SIZE, flush_interval: float = DB_FLUSH_INTERVAL,
+                                  spill_path: str = SPILL_PATH, sink=None,
+                                  save_images: bool = SAVE_ANNOTATED_IMAGES, save_json: bool = SAVE_JSON,
+                                  write_db: bool = WRITE_DB, json_format: str = JSON_FORMAT,
+                                  artifact_workers: int = ARTIFACT_WORKERS, force: bool = False,
+                                  ledger_path: str = None, imgsz: int = IMGSZ, conf: float = CONF,
+                                  use_cache: bool = USE_DETECTION_CACHE, cache_path: str = DETECTION_CACHE_FILE):
+    """
+    Runs YOLO detections on all images in a folder and inserts results into MySQL,
+    or into the result sink given by sink ("sqlite:<file>", "csv:<folder>", "parquet:<folder>").
+    Images are decoded ahead of time by decode_workers threads and sent to the model batch_size at a time.
+    Rows go to a background writer thread that writes them flush_size at a time (or every flush_interval
+    seconds) as multi-row INSERTs; batches that fail are spilled to spill_path for replay_spill().
+    save_images / save_json / write_db switch each output on or off; annotated images and JSON are
+    written by artifact_workers background threads (JSON as one <folder>.jsonl unless json_format="files").
+    When writing to the DB, images whose rows were already committed for the same content and weights
+    (completion ledger at ledger_path, next to the folder by default) are skipped unless force is set.
+    With use_cache, images whose content was already detected with the same weights, imgsz and conf
+    (in any study) get their boxes from the detection cache at cache_path instead of the model.
     """
     if not os.path.exists(images_folder):
         print(f"Folder not found: {images_folder}")
@@ -83,64 +198,164 @@ def run_yolo_detections_on_folder(images_folder: str, model_weights_path: str):
 
     detection_img_dir = os.path.join(os.path.dirname(images_folder), "detections_images")
     detection_json_dir = os.path.join(os.path.dirname(images_folder), "detection_jsons")
-    os.makedirs(detection_img_dir, exist_ok=True)
-    os.makedirs(detection_json_dir, exist_ok=True)
+    if save_images:
+        os.makedirs(detection_img_dir, exist_ok=True)
+    if save_json:
+        os.makedirs(detection_json_dir, exist_ok=True)
+    jsonl_path = None
+    if save_json and json_format == "jsonl":
+        jsonl_path = os.path.join(detection_json_dir, os.path.basename(os.path.normpath(images_folder)) + ".jsonl")
 
     print(f"Loading YOLO model from: {model_weights_path}")
     model = YOLO(model_weights_path)
 
-    image_files = [f for f in os.listdir(images_folder) if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
-    total = len(image_files)
-    if not total:
+    image_files = list_images(images_folder)
+    if not image_files:
         print(f"No images found in {images_folder}")
         return
 
-    print(f"Running detections on {total} images...\n")
-    total_start = time.time()
-    times = []
-
-    for idx, image_file in enumerate(image_files, start=1):
-        image_start = time.time()
-        image_path = os.path.join(images_folder, image_file)
-        print(f"[{idx}/{total}] Processing: {image_file}")
+    # Completion ledger: skip images already committed with these weights, checkpoint the others
+    ledger = None
+    if write_db:
+        ledger = CompletionLedger(ledger_path or os.path.join(os.path.dirname(images_folder), LEDGER_FILE),
+                                  model_weights_path)
+    todo, skipped = pending_media(ledger, images_folder, image_files, force)
+    if skipped:
+        print(f"Skipping {skipped} images already in the completion ledger (use force=True to redo them)")
+    image_files = [image_file for image_file, _ in todo]
+    ledger_keys = dict(todo)
+    total = len(image_files)
+    if not total:
+        print("Nothing left to process")
+        if ledger:
+            ledger.close()
+        return
 
-        try:
-            results = model(image_path)
+    # Detection cache: images already seen with the same weights, imgsz and conf skip inference
+    cache, cached, content_hashes = None, {}, {}
+    if use_cache:
+        cache = DetectionCache(cache_path, file_sha256(model_weights_path), imgsz, conf)
+        content_hashes = {image_file: key[1] if key else file_sha256(os.path.join(images_folder, image_file))
+                          for image_file, key in todo}
+        cached = cache.get_many(content_hashes.values())
+    cached_files = [f for f in image_files if content_hashes.get(f) in cached]
+    infer_files = [f for f in image_files if content_hashes.get(f) not in cached]
 
-            # Save annotated image
-            save_path = os.path.join(detection_img_dir, image_file)
-            results[0].save(filename=save_path)
-            print(f"Saved annotated image: {save_path}")
+    print(f"Running detections on {len(infer_files)} images (batch size {batch_size}),"
+          f" {len(cached_files)} from the detection cache...\n")
+    total_start = time.time()
+    inference_time = 0.0
+    done = 0
+    writer = None
+    if write_db:
+        writer = AsyncDetectionWriter(flush_size, flush_interval, specific_config=db_config, spill_path=spill_path,
+                                      sink=sink, on_committed=ledger.mark_done)
+    artifacts = None
+    if save_images or save_json:
+        artifacts = ArtifactWriter(detection_img_dir if save_images else None,
+                                   detection_json_dir if save_json else None, jsonl_path, artifact_workers,
+                                   jsonl_mode="a" if skipped else "w")
 
-            # Save detection JSON
-            json_data = results[0].to_json()
-            json_filename = os.path.splitext(image_file)[0] + ".json"
-            json_path = os.path.join(detection_json_dir, json_filename)
-            with open(json_path, "w", encoding="utf-8") as jf:
-                json.dump(json.loads(json_data), jf, indent=2, ensure_ascii=False)
-            print(f"Saved detection JSON: {json_path}")
+    def emit(image_file: str, orig_shape, xyxy, conf_values, cls, result=None):
+        """JSON / annotated image to the artifact writers, rows to the DB writer."""
+        names = [model.names[c] for c in cls.tolist()]
+        if artifacts:
+            summary = detections_summary(xyxy, conf_values, cls, names) if save_json else None
+            if result is None and save_images:  # cache hit: rebuild a result to draw from
+                boxes = np.hstack([xyxy, conf_values[:, None], cls[:, None]])
+                result = Results(cv2.imread(os.path.join(images_folder, image_file)), image_file, model.names,
+                                 boxes=boxes)
+            artifacts.submit(image_file, result, summary)
+        if writer:
+            writer.submit(IMAGE_TABLE, build_detection_rows(image_file, orig_shape, xyxy, conf_values, names),
+                          key=ledger_keys[image_file])
 
-            # Insert detection results into DB
-            insert_yolo_results(image_file, results)
-            print(f"Inserted detection results into DB for: {image_file}")
+    try:
+        for image_file in cached_files:
+            done += 1
+            orig_shape, boxes = cached[content_hashes[image_file]]
+            try:
+                emit(image_file, orig_shape, boxes[:, :4].copy(), boxes[:, 4].copy(), boxes[:, 5].astype(int))
+            except Exception as e:
+                print(f"Error processing cached {image_file}: {e}")
+        if cached_files:
+            print(f"[{done}/{total}] Emitted {len(cached_files)} images from the detection cache")
 
-        except Exception as e:
-            print(f"Error processing {image_file}: {e}")
+        for batch_files, batch_images in iter_decoded_batches(images_folder, infer_files, batch_size, decode_workers):
+            batch_start = time.time()
+            try:
+                batch_results = model(batch_images, imgsz=imgsz, conf=conf, verbose=False)
+            except Exception as e:
+                print(f"Error running batch {batch_files[0]}..{batch_files[-1]}: {e}")
+                continue
+            inference_time += time.time() - batch_start
 
-        image_elapsed = time.time() - image_start
-        times.append(image_elapsed)
-        print(f"Time for {image_file}: {image_elapsed:.2f}s\n")
+            new_entries = []
+            for image_file, result in zip(batch_files, batch_results):
+                done += 1
+                print(f"[{done}/{total}] Processing: {image_file}")
+                try:
+                    # Boxes as arrays, read once for the cache, the JSON and the DB rows
+                    xyxy, conf_values, cls = result_arrays(result)
+                    if cache:
+                        new_entries.append((content_hashes[image_file], result.orig_shape[:2],
+                                            np.hstack([xyxy, conf_values[:, None], cls[:, None]])))
+                    emit(image_file, result.orig_shape, xyxy, conf_values, cls, result)
+                except Exception as e:
+                    print(f"Error processing {image_file}: {e}")
+            if cache:
+                cache.put_many(new_entries)
 
+            batch_elapsed = time.time() - batch_start
+            print(f"Batch of {len(batch_files)} images: {batch_elapsed:.2f}s\n")
+    finally:
+        # drain on errors too: rows of finished images are committed and checkpointed
+        if artifacts:
+            print("Waiting for artifact writers to finish...")
+            artifacts.close()
+        if writer:
+            print("Waiting for the DB writer to drain...")
+            writer.close()
+            ledger.close()
+        if cache:
+            print(cache.report())
+            cache.close()
     total_elapsed = time.time() - total_start
-    avg_time = sum(times) / len(times) if times else 0
+    avg_time = total_elapsed / done if done else 0
     print("\nDetection complete.")
-    print(f"Annotated images: {detection_img_dir}")
-    print(f"JSON results: {detection_json_dir}")
+    if save_images:
+        print(f"Annotated images: {detection_img_dir}")
+    if save_json:
+        print(f"JSON results: {jsonl_path or detection_json_dir}")
     print(f"Total time: {total_elapsed:.2f}s")
-    print(f"Average per image: {avg_time:.2f}s\n")
+    print(f"Average per image: {avg_time:.2f}s")
+    print(f"Inference throughput (batch size {batch_size}): {done / inference_time if inference_time else 0:.2f} images/s\n")
+
+
+def benchmark_batch_sizes(images_folder: str, model_weights_path: str, batch_sizes=(1, 4, 8, 16),
+                          decode_workers: int = DECODE_WORKERS):
+    """Inference-only pass over the folder for each batch size (no files, no DB), printing images/s."""
+    model = YOLO(model_weights_path)
+    image_files = list_images(images_folder)
+    if not image_files:
+        print(f"No images found in {images_folder}")
+        return
+
+    model(cv2.imread(os.path.join(images_folder, image_files[0])), verbose=False)  # warm-up
+    for batch_size in batch_sizes:
+        start = time.time()
+        count = 0
+        for _, batch_images in iter_decoded_batches(images_folder, image_files, batch_size, decode_workers):
+            model(batch_images, verbose=False)
+            count += len(batch_images)
+        elapsed = time.time() - start
+        print(f"Batch size {batch_size:>3}: {count} images in {elapsed:.2f}s -> {count / elapsed:.2f} images/s")
 
 
-image_path = "test_insert_db/images"
-model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt" 
+if __name__ == "__main__":
+    image_path = "test_insert_db/images"
+    model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt" 
 
-run_yolo_detections_on_folder(images_folder=image_path, model_weights_path=model_path)
+    run_yolo_detections_on_folder(images_folder=image_path, model_weights_path=model_path,
+                                  force="--force" in sys.argv)
+    #benchmark_batch_sizes(images_folder=image_path, model_weights_path=model_path)
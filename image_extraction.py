@@ -18,11 +18,12 @@ def extract_frames_standard(cap, output_folder, selected_frames, base_name, star
     part_label = f"start{int(start_sec)}s" if start_sec is not None else "full"
     step_label = f"step{step}" if step else "step1"
 
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
+    # grab() (decode) every frame but only retrieve() (convert to BGR) the selected ones
+    while cap.grab():
         if frame_count in selected_frames:
+            ret, frame = cap.retrieve()
+            if not ret:
+                break
             filename = f"{base_name}_-{saved_frame_count:05d}.jpg"
             filepath = os.path.join(output_folder, filename)
             cv2.imwrite(filepath, frame)
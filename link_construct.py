@@ -1,6 +1,7 @@
 import os
+import json
+from datetime import datetime
 from collections import defaultdict
-from dc_utils import mysql_execute_select_dict
 
 
 # ---------- CONFIG ----------
@@ -15,25 +16,49 @@ VIDEO_TYPES = {
 
 TWITTER_PLATFORM_ID = 3
 
+STUDY_IDS = ["53"]  # every study listed here is handled by the same query pass
+
 START_DATE = "2025-08-01 00:00:00"
 END_DATE = "2025-10-31 23:59:59" # l'ensemble des publications allant du 01/08 au 31/10
 
+CHUNK_SIZE = 5000  # publications fetched per query page
+
+# Incremental mode: only publications newer than the study's watermark are fetched and
+# their links appended to the existing files (START_DATE is only used on the first run)
+INCREMENTAL = False
+WATERMARK_FILE = "link_watermarks.json"
+FOLDER_SUFFIX = "_10"  # 10 = month the links were built for; use "" for incremental runs
+
 
 # ---------- SQL QUERY ----------
 
+# One page for a batch of studies: the inner query picks the next CHUNK_SIZE publications after the
+# (id_study, id_plateform, id_publication) key of the previous page, the outer joins fetch their media.
+# {study_placeholders} is filled with one %s per study.
 SQL_QUERY = """
 SELECT
     spa.id_study,
     spa.id_plateform,
     spa.id_publication,
+    spa.publication_datetime,
     pmedia.media_url,
     pmedia.type AS media_type,
     pms.status,
     p.name AS platform_name
-FROM study_publication_affectation spa
-LEFT JOIN publications_meta pm
-    ON pm.plateform_id = spa.id_plateform
-    AND pm.publication_id = spa.id_publication
+FROM (
+    SELECT spa.id_study, spa.id_plateform, spa.id_publication, pm.publication_datetime
+    FROM study_publication_affectation spa
+    JOIN publications_meta pm
+        ON pm.plateform_id = spa.id_plateform
+        AND pm.publication_id = spa.id_publication
+    WHERE spa.id_study IN ({study_placeholders})
+      AND spa.flag_validated > 0
+      AND pm.publication_datetime BETWEEN %s AND %s
+      AND (spa.id_study > %s OR (spa.id_study = %s
+           AND (spa.id_plateform > %s OR (spa.id_plateform = %s AND spa.id_publication > %s))))
+    ORDER BY spa.id_study, spa.id_plateform, spa.id_publication
+    LIMIT %s
+) spa
 LEFT JOIN plateforms p
     ON p.id_plateform = spa.id_plateform
 LEFT JOIN publication_medias pmedia
@@ -41,9 +66,7 @@ LEFT JOIN publication_medias pmedia
     AND pmedia.publication_id = spa.id_publication
 LEFT JOIN publication_media_status pms
     ON pms.publication_id COLLATE utf8mb4_0900_as_cs = spa.id_publication
-WHERE spa.id_study = %s
-  AND spa.flag_validated > 0
-  AND pm.publication_datetime BETWEEN %s AND %s;
+ORDER BY spa.id_study, spa.id_plateform, spa.id_publication;
 """
 
 
@@ -60,89 +83,187 @@ def generate_aws_link(pub_id: str, platform_id: int, media_type: str) -> str:
     return f"https://dataclutcher-reco.s3.eu-west-3.amazonaws.com/{pub_id}_{platform_id}.{ext}"
 
 
+def link_folder(kind: str, study_id: str) -> str:
+    """Folder holding a study's "images" or "videos" link files; downloader.py reads the links from here."""
+    return f"{kind}_{study_id}{FOLDER_SUFFIX}"
+
+
 def get_media_folder(media_type: str, study_id: str) -> str:
     """Determine appropriate folder name for media type."""
     media_type = media_type.lower() if media_type else ""
     if media_type in (t.lower() for t in IMAGE_TYPES):
-        return f"images_{study_id}_10"
+        return link_folder("images", study_id)
     elif media_type in (t.lower() for t in VIDEO_TYPES):
-        return f"videos_{study_id}_10"
+        return link_folder("videos", study_id)
     else:
         return "unknown"
 
 
 def ensure_folders_exist(study_id):
     """Ensure image and video folders exist for a given study."""
-    for folder in [f"images_{study_id}", f"videos_{study_id}"]:
+    for folder in [link_folder("images", study_id), link_folder("videos", study_id)]:
         try:
             os.makedirs(folder, exist_ok=True)
         except OSError as e:
             print(f"Warning: Could not create folder '{folder}': {e}")
 
 
-def write_links_to_file(folder: str, filename: str, links: list[str]):
-    """Write a list of URLs to a text file inside the specified folder."""
-    path = os.path.join(folder, filename)
-    try:
-        with open(path, "w") as f:
-            for link in links:
-                f.write(link + "\n")
-        print(f"{len(links)} links written to {path}")
-    except IOError as e:
-        print(f"Error writing file {path}: {e}")
+def load_watermark(study_id: str):
+    """Latest publication_datetime already turned into links for this study, or None."""
+    if not os.path.exists(WATERMARK_FILE):
+        return None
+    with open(WATERMARK_FILE, "r") as f:
+        return json.load(f).get(str(study_id), {}).get("publication_datetime")
+
+
+def save_watermark(study_id: str, publication_datetime: str):
+    """Store the study's watermark, never moving it backwards."""
+    watermarks = {}
+    if os.path.exists(WATERMARK_FILE):
+        with open(WATERMARK_FILE, "r") as f:
+            watermarks = json.load(f)
+    current = watermarks.get(str(study_id), {}).get("publication_datetime")
+    if current and current >= publication_datetime:
+        return
+    watermarks[str(study_id)] = {
+        "publication_datetime": publication_datetime,
+        "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+    }
+    tmp_path = WATERMARK_FILE + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(watermarks, f, indent=2)
+    os.replace(tmp_path, WATERMARK_FILE)
+
+
+def read_existing_links(path: str) -> set:
+    if not os.path.exists(path):
+        return set()
+    with open(path, "r") as f:
+        return {line.strip() for line in f if line.strip()}
+
+
+def iter_rows_in_chunks(study_ids: list, start_date: str, end_date: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Yield the rows of all study_ids one page (chunk_size publications) at a time, so only one page is
+    ever in memory and the whole batch costs a single scan of the join.
+    Pages are keyset-paginated on (id_study, id_plateform, id_publication): each query is an index
+    range scan and all rows of a publication always come in the same page.
+    """
+    from dc_utils import mysql_execute_select_dict  # imported here so downloader.py can use link_folder without it
+
+    query = SQL_QUERY.format(study_placeholders=", ".join(["%s"] * len(study_ids)))
+    last_study, last_platform, last_publication = -1, -1, ""
+    while True:
+        rows = mysql_execute_select_dict(
+            query,
+            (*study_ids, start_date, end_date, last_study, last_study,
+             last_platform, last_platform, last_publication, chunk_size),
+        )
+        # LIMIT counts inner rows, and duplicate meta rows of one publication can make a full page look short:
+        # only an empty page means the end
+        if not rows:
+            return
+        yield rows
+        last = rows[-1]
+        last_study, last_platform, last_publication = last["id_study"], last["id_plateform"], last["id_publication"]
 
 
 # ---------- MAIN LOGIC ----------
-def process_media(rows: list[dict], study_id: str):
-    twitter_links = defaultdict(set)  
-    aws_links = defaultdict(set)     
+def process_media(chunks, append: bool = False) -> dict:
+    """
+    Consume row chunks (see iter_rows_in_chunks) and write each new link to its file as it comes,
+    partitioned by the row's study into that study's image/video folders.
+    A publication never spans two chunks, so de-duplicating within a chunk is enough and memory
+    stays bounded by the chunk size.
+    With append=True (incremental mode) the files are kept and only links not already in them are added.
+    Returns {study_id: latest publication_datetime seen, as a string}. Write errors propagate: pages are not
+    ordered by date, so a partial run must not be used as a watermark.
+    """
+    files = {}
+    existing = {}
+    link_counts = defaultdict(int)
     unknown_media = 0
+    total_rows = 0
+    latest = {}
 
-    for row in rows:
-        platform_id = row.get("id_plateform")
-        media_type = row.get("media_type")
-        folder = get_media_folder(media_type, study_id)
-
-        if folder == "unknown":
-            unknown_media += 1
-            print(f"Unknown media type '{media_type}' for publication {row.get('id_publication')}")
-            continue
-
-        if platform_id == TWITTER_PLATFORM_ID:
-            media_url = row.get("media_url")
-            if media_url:
-                twitter_links[folder].add(media_url)  # use add()
-            else:
-                print(f" Missing media_url for Twitter publication {row.get('id_publication')} (study {study_id})")
-                continue
-        else:
-            aws_links[folder].add(generate_aws_link(row["id_publication"], platform_id, media_type))
-
-    # Convert sets back to lists for writing files
-    for folder, links in twitter_links.items():
-        if links:
-            write_links_to_file(folder, "twitter_links.txt", list(links))
-    for folder, links in aws_links.items():
-        if links:
-            write_links_to_file(folder, "aws_links.txt", list(links))
+    def append_link(folder: str, filename: str, link: str):
+        path = os.path.join(folder, filename)
+        if path not in files:
+            os.makedirs(folder, exist_ok=True)
+            existing[path] = read_existing_links(path) if append else set()
+            files[path] = open(path, "a" if append else "w")
+        if link in existing[path]:
+            return
+        files[path].write(link + "\n")
+        link_counts[path] += 1
+
+    try:
+        for rows in chunks:
+            total_rows += len(rows)
+            seen = set()
+            for row in rows:
+                study_id = str(row.get("id_study"))
+                published = row.get("publication_datetime")
+                if published is not None and str(published) > latest.get(study_id, ""):
+                    latest[study_id] = str(published)
+                platform_id = row.get("id_plateform")
+                media_type = row.get("media_type")
+                folder = get_media_folder(media_type, study_id)
+
+                if folder == "unknown":
+                    unknown_media += 1
+                    print(f"Unknown media type '{media_type}' for publication {row.get('id_publication')}")
+                    continue
+
+                if platform_id == TWITTER_PLATFORM_ID:
+                    media_url = row.get("media_url")
+                    if not media_url:
+                        print(f" Missing media_url for Twitter publication {row.get('id_publication')} (study {study_id})")
+                        continue
+                    link, filename = media_url, "twitter_links.txt"
+                else:
+                    link, filename = generate_aws_link(row["id_publication"], platform_id, media_type), "aws_links.txt"
+
+                if (folder, link) in seen:
+                    continue
+                seen.add((folder, link))
+                append_link(folder, filename, link)
+    finally:
+        for f in files.values():
+            f.close()
+
+    print(f"Retrieved {total_rows} records from DB")
+    for path, count in link_counts.items():
+        print(f"{count} links written to {path}")
 
     if unknown_media > 0:
         print(f"Skipped {unknown_media} rows due to unknown media types.")
+    return latest
+
 
+def main(study_ids: list = STUDY_IDS, incremental: bool = INCREMENTAL):
+    """Main script entry point: builds the links of every study in study_ids with one query pass."""
+    study_ids = [str(study_id) for study_id in study_ids]
+    for study_id in study_ids:
+        ensure_folders_exist(study_id)
 
-def main():
-    """Main script entry point."""
-    study_id = "53"
-    ensure_folders_exist(study_id)
+    start_date, end_date = START_DATE, END_DATE
+    if incremental:
+        # The batch starts at the oldest watermark; rows a study already has are skipped as existing links
+        start_date = min(load_watermark(study_id) or START_DATE for study_id in study_ids)
+        end_date = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        print(f"Incremental run for studies {', '.join(study_ids)}: publications from {start_date} to {end_date}")
 
     try:
-        rows = mysql_execute_select_dict(SQL_QUERY, (study_id, START_DATE, END_DATE))
+        latest = process_media(iter_rows_in_chunks(study_ids, start_date, end_date), append=incremental)
     except Exception as e:
-        print(f"Error querying database: {e}")
+        # watermarks only move once every page is written, so the next run redoes this one
+        print(f"Error building links, watermarks not updated: {e}")
         return
 
-    print(f"Retrieved {len(rows)} records from DB")
-    process_media(rows, study_id)
+    for study_id, published in latest.items():
+        save_watermark(study_id, published)
+        print(f"Watermark for study {study_id}: {published}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,233 @@
+import os
+import csv
+import glob
+import time
+import sqlite3
+import threading
+from typing import Iterator, List, Tuple
+
+
+# ---------- Schema (shared by every backend) ----------
+TABLE_SCHEMAS = {
+    "yolo_image_detection": (
+        ("study_id", "int"), ("media_id", "str"), ("plateform_id", "str"), ("logo", "str"), ("size", "str"),
+        ("area", "float"), ("areaPercentage", "float"), ("confidence", "float"),
+        ("x1", "float"), ("y1", "float"), ("x2", "float"), ("y2", "float"),
+    ),
+    "yolo_video_detection": (
+        ("study_id", "int"), ("media_id", "str"), ("plateform_id", "str"), ("logo", "str"), ("size", "str"),
+        ("area", "float"), ("areaPercentage", "float"), ("timeBegin", "str"), ("timeEnd", "str"),
+        ("confidence", "float"), ("x1", "float"), ("y1", "float"), ("x2", "float"), ("y2", "float"),
+    ),
+}
+TABLE_COLUMNS = {table: tuple(name for name, _ in schema) for table, schema in TABLE_SCHEMAS.items()}
+
+SQLITE_TYPES = {"int": "INTEGER", "str": "TEXT", "float": "REAL"}
+CASTS = {"int": int, "str": str, "float": float}
+
+
+def cast_row(table: str, values: Tuple) -> Tuple:
+    """Coerce a row to the schema types (NULLs and empty CSV cells stay None)."""
+    return tuple(None if value is None or value == "" else CASTS[kind](value)
+                 for (_, kind), value in zip(TABLE_SCHEMAS[table], values))
+
+
+def build_multirow_insert(table: str, n_rows: int) -> str:
+    """INSERT ... VALUES (...), (...), ... with one placeholder group per row."""
+    columns = TABLE_COLUMNS[table]
+    group = "(" + ", ".join(["%s"] * len(columns)) + ")"
+    return (f"INSERT INTO {table} ({', '.join(columns)}) VALUES "
+            + ", ".join([group] * n_rows) + ";")
+
+
+# ---------- Backends ----------
+class ResultSink:
+    """
+    Destination for detection rows. write_rows() receives one batch for one table
+    and must write it in bulk (one statement / transaction / row group).
+    """
+
+    name = "sink"
+
+    def write_rows(self, table: str, rows: List[Tuple]):
+        raise NotImplementedError
+
+    def read_rows(self, table: str) -> Iterator[Tuple]:
+        raise NotImplementedError(f"{self.name} sink cannot be read back")
+
+    def close(self):
+        pass
+
+
+class MySQLSink(ResultSink):
+    """Multi-row INSERT through dc_utils, imported here so the local backends work without it."""
+
+    name = "mysql"
+
+    def __init__(self, specific_config='default'):
+        from dc_utils import mysql_execute_insert
+        self._insert = mysql_execute_insert
+        self.specific_config = specific_config
+
+    def write_rows(self, table: str, rows: List[Tuple]):
+        sql = build_multirow_insert(table, len(rows))
+        params = tuple(value for row in rows for value in row)
+        self._insert(sql, params, specific_config=self.specific_config)
+
+
+class SQLiteSink(ResultSink):
+    """One SQLite file with a table per detection table; each batch is one executemany + commit."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        for table, schema in TABLE_SCHEMAS.items():
+            columns = ", ".join(f"{name} {SQLITE_TYPES[kind]}" for name, kind in schema)
+            self._conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns})")
+        self._conn.commit()
+
+    def write_rows(self, table: str, rows: List[Tuple]):
+        placeholders = ", ".join(["?"] * len(TABLE_COLUMNS[table]))
+        with self._lock:
+            self._conn.executemany(
+                f"INSERT INTO {table} ({', '.join(TABLE_COLUMNS[table])}) VALUES ({placeholders})",
+                [cast_row(table, row) for row in rows],
+            )
+            self._conn.commit()
+
+    def read_rows(self, table: str) -> Iterator[Tuple]:
+        with self._lock:
+            rows = self._conn.execute(f"SELECT {', '.join(TABLE_COLUMNS[table])} FROM {table}").fetchall()
+        yield from rows
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CSVSink(ResultSink):
+    """Appends to <folder>/<table>.csv, writing the header when the file is new."""
+
+    name = "csv"
+
+    def __init__(self, folder: str):
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+
+    def path_for(self, table: str) -> str:
+        return os.path.join(self.folder, f"{table}.csv")
+
+    def write_rows(self, table: str, rows: List[Tuple]):
+        path = self.path_for(table)
+        new_file = not os.path.exists(path)
+        with open(path, "a", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(TABLE_COLUMNS[table])
+            writer.writerows(cast_row(table, row) for row in rows)
+
+    def read_rows(self, table: str) -> Iterator[Tuple]:
+        path = self.path_for(table)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", newline="", encoding="utf-8") as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            for row in reader:
+                yield cast_row(table, row)
+
+
+class ParquetSink(ResultSink):
+    """
+    Columnar output: one <folder>/<table>-<timestamp>.parquet file per table and run,
+    each batch written as one row group. Needs pyarrow.
+    """
+
+    name = "parquet"
+
+    def __init__(self, folder: str):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("The parquet sink needs pyarrow (pip install pyarrow)") from e
+        self._pa, self._pq = pa, pq
+        os.makedirs(folder, exist_ok=True)
+        self.folder = folder
+        self.run_stamp = time.strftime("%Y%m%d-%H%M%S")
+        arrow_types = {"int": pa.int64(), "str": pa.string(), "float": pa.float64()}
+        self.schemas = {table: pa.schema([(name, arrow_types[kind]) for name, kind in schema])
+                        for table, schema in TABLE_SCHEMAS.items()}
+        self._writers = {}
+        self._lock = threading.Lock()
+
+    def write_rows(self, table: str, rows: List[Tuple]):
+        columns = list(zip(*(cast_row(table, row) for row in rows)))
+        batch = self._pa.Table.from_arrays(
+            [self._pa.array(column, type=field.type) for column, field in zip(columns, self.schemas[table])],
+            schema=self.schemas[table],
+        )
+        with self._lock:
+            if table not in self._writers:
+                path = os.path.join(self.folder, f"{table}-{self.run_stamp}.parquet")
+                self._writers[table] = self._pq.ParquetWriter(path, self.schemas[table])
+            self._writers[table].write_table(batch)
+
+    def read_rows(self, table: str) -> Iterator[Tuple]:
+        for path in sorted(glob.glob(os.path.join(self.folder, f"{table}-*.parquet"))):
+            if any(w.where == path for w in self._writers.values()):
+                continue  # still being written by this run
+            data = self._pq.read_table(path).to_pydict()
+            yield from zip(*(data[name] for name in TABLE_COLUMNS[table]))
+
+    def close(self):
+        with self._lock:
+            for writer in self._writers.values():
+                writer.close()
+            self._writers = {}
+
+
+def make_sink(spec=None, specific_config='default') -> ResultSink:
+    """
+    Build a sink from a spec string: "mysql" (default), "sqlite:<file.db>", "csv:<folder>"
+    or "parquet:<folder>". A ResultSink instance is returned unchanged.
+    """
+    if isinstance(spec, ResultSink):
+        return spec
+    kind, _, target = (spec or "mysql").partition(":")
+    if kind == "mysql":
+        return MySQLSink(target or specific_config)
+    if not target:
+        raise ValueError(f"Sink '{kind}' needs a path, e.g. '{kind}:results'")
+    if kind == "sqlite":
+        return SQLiteSink(target)
+    if kind == "csv":
+        return CSVSink(target)
+    if kind == "parquet":
+        return ParquetSink(target)
+    raise ValueError(f"Unknown result sink: {spec}")
+
+
+def bulk_load(source, destination="mysql", specific_config='default', batch_size: int = 5000):
+    """Copy every row of a local sink (SQLite / CSV / Parquet) into another sink, batch_size rows per write."""
+    source, destination = make_sink(source), make_sink(destination, specific_config)
+    try:
+        for table in TABLE_SCHEMAS:
+            batch, copied = [], 0
+            for row in source.read_rows(table):
+                batch.append(row)
+                if len(batch) >= batch_size:
+                    destination.write_rows(table, batch)
+                    copied += len(batch)
+                    batch = []
+            if batch:
+                destination.write_rows(table, batch)
+                copied += len(batch)
+            print(f"{table}: {copied} rows copied to {destination.name}")
+    finally:
+        source.close()
+        destination.close()
@@ -1,8 +1,8 @@
 # Simple Online and Realtime Tracking (SORT)
 # Pure Python implementation by this one guy Alex Bewley, https://github.com/abewley/sort
-# Adapted to work with YOLOv8 outputs
+# Adapted to work with YOLOv8 outputs, with the Kalman filters of all tracks batched in NumPy arrays
 import numpy as np
-from filterpy.kalman import KalmanFilter
+from scipy.optimize import linear_sum_assignment
 
 
 def iou(bb_test, bb_gt):
@@ -18,138 +18,170 @@ def iou(bb_test, bb_gt):
     return o
 
 
-def convert_bbox_to_z(bbox):
-    w = bbox[2] - bbox[0]
-    h = bbox[3] - bbox[1]
-    x = bbox[0] + w / 2.
-    y = bbox[1] + h / 2.
-    s = w * h
-    r = w / float(h)
-    return np.array([x, y, s, r]).reshape((4, 1))
-
-
-def convert_x_to_bbox(x, score=None):
-    w = np.sqrt(x[2] * x[3])
-    h = x[2] / w
-    if score is None:
-        return np.array([x[0] - w / 2., x[1] - h / 2., x[0] + w / 2., x[1] + h / 2.]).reshape((1, 4))
-    else:
-        return np.array([x[0] - w / 2., x[1] - h / 2., x[0] + w / 2., x[1] + h / 2., score]).reshape((1, 5))
-
-
-class KalmanBoxTracker:
-    count = 0
-
-    def __init__(self, bbox):
-        # 7D state: [x, y, s, r, x_dot, y_dot, s_dot]
-        # 4D measurement: [x, y, s, r]
-        self.kf = KalmanFilter(dim_x=7, dim_z=4)
-        self.kf.F = np.array([
-            [1, 0, 0, 0, 1, 0, 0],
-            [0, 1, 0, 0, 0, 1, 0],
-            [0, 0, 1, 0, 0, 0, 1],
-            [0, 0, 0, 1, 0, 0, 0],
-            [0, 0, 0, 0, 1, 0, 0],
-            [0, 0, 0, 0, 0, 1, 0],
-            [0, 0, 0, 0, 0, 0, 1]
-        ])
-
-        # Corrected H matrix (4x7, consistent lengths)
-        self.kf.H = np.array([
-            [1, 0, 0, 0, 0, 0, 0],
-            [0, 1, 0, 0, 0, 0, 0],
-            [0, 0, 1, 0, 0, 0, 0],
-            [0, 0, 0, 1, 0, 0, 0]
-        ])
-
-        self.kf.R[2:, 2:] *= 10.
-        self.kf.P[4:, 4:] *= 1000.
-        self.kf.P *= 10.
-        self.kf.Q[-1, -1] *= 0.01
-        self.kf.Q[4:, 4:] *= 0.01
-
-        self.kf.x[:4] = convert_bbox_to_z(bbox)
-        self.time_since_update = 0
-        self.id = KalmanBoxTracker.count
-        KalmanBoxTracker.count += 1
-        self.history = []
-        self.hits = 0
-        self.hit_streak = 0
-        self.age = 0
-
-    def update(self, bbox):
-        self.time_since_update = 0
-        self.history = []
-        self.hits += 1
-        self.hit_streak += 1
-        self.kf.update(convert_bbox_to_z(bbox))
-
-    def predict(self):
-        if (self.kf.x[6] + self.kf.x[2]) <= 0:
-            self.kf.x[6] *= 0.0
-        self.kf.predict()
-        self.age += 1
-        if self.time_since_update > 0:
-            self.hit_streak = 0
-        self.time_since_update += 1
-        self.history.append(convert_x_to_bbox(self.kf.x))
-        return self.history[-1]
-
-    def get_state(self):
-        return convert_x_to_bbox(self.kf.x)
+def iou_batch(bb_test, bb_gt):
+    """IoU matrix (len(bb_test), len(bb_gt)) of two (N, 4+) arrays of x1, y1, x2, y2 boxes, in one broadcast."""
+    bb_test = np.asarray(bb_test, dtype=float)[:, None, :4]
+    bb_gt = np.asarray(bb_gt, dtype=float)[None, :, :4]
+    w = np.maximum(0., np.minimum(bb_test[..., 2], bb_gt[..., 2]) - np.maximum(bb_test[..., 0], bb_gt[..., 0]))
+    h = np.maximum(0., np.minimum(bb_test[..., 3], bb_gt[..., 3]) - np.maximum(bb_test[..., 1], bb_gt[..., 1]))
+    wh = w * h
+    union = ((bb_test[..., 2] - bb_test[..., 0]) * (bb_test[..., 3] - bb_test[..., 1])
+             + (bb_gt[..., 2] - bb_gt[..., 0]) * (bb_gt[..., 3] - bb_gt[..., 1]) - wh)
+    return np.divide(wh, union, out=np.zeros_like(wh), where=union > 0)
+
+
+def linear_assignment(iou_matrix, iou_threshold):
+    """
+    One-to-one matching of the candidate pairs (IoU >= iou_threshold and > 0) maximizing their total IoU
+    (Hungarian, scipy linear_sum_assignment), as (K, 2) index pairs. Pairs below the threshold score 0,
+    so they can never displace a candidate. When no row or column has more than one candidate there is
+    nothing to choose: every candidate is matched and the solver is skipped.
+    """
+    if iou_matrix.size == 0:
+        return np.empty((0, 2), dtype=int)
+    candidates = (iou_matrix >= iou_threshold) & (iou_matrix > 0)
+    if candidates.sum(1).max() <= 1 and candidates.sum(0).max() <= 1:
+        return np.stack(np.where(candidates), axis=1)
+    rows, cols = linear_sum_assignment(-np.where(candidates, iou_matrix, 0.))
+    keep = candidates[rows, cols]
+    return np.stack([rows[keep], cols[keep]], axis=1)
+
+
+def convert_bbox_to_z(bboxes):
+    """(N, 4+) x1, y1, x2, y2 boxes -> (N, 4) measurements x, y, s (area), r (aspect ratio)."""
+    bboxes = np.asarray(bboxes, dtype=float)
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    return np.stack([bboxes[:, 0] + w / 2., bboxes[:, 1] + h / 2., w * h, w / h], axis=1)
+
+
+def convert_x_to_bbox(x):
+    """(N, 7+) states -> (N, 4) x1, y1, x2, y2 boxes (NaN rows for degenerate states)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        w = np.sqrt(x[:, 2] * x[:, 3])
+        h = x[:, 2] / w
+    return np.stack([x[:, 0] - w / 2., x[:, 1] - h / 2., x[:, 0] + w / 2., x[:, 1] + h / 2.], axis=1)
+
+
+# Constant-velocity model shared by every track.
+# 7D state: [x, y, s, r, x_dot, y_dot, s_dot], 4D measurement: [x, y, s, r]
+KF_F = np.eye(7)
+KF_F[0, 4] = KF_F[1, 5] = KF_F[2, 6] = 1.
+KF_Q = np.diag([1., 1., 1., 1., .01, .01, .0001])
+KF_R = np.diag([1., 1., 10., 10.])
+KF_P0 = np.diag([10., 10., 10., 10., 1e4, 1e4, 1e4])
 
 
 def associate_detections_to_trackers(detections, trackers, iou_threshold=0.3):
     if len(trackers) == 0:
         return np.empty((0, 2), dtype=int), np.arange(len(detections)), np.empty((0), dtype=int)
-    iou_matrix = np.zeros((len(detections), len(trackers)), dtype=np.float32)
-    for d, det in enumerate(detections):
-        for t, trk in enumerate(trackers):
-            iou_matrix[d, t] = iou(det, trk)
-    matched_indices = np.stack(np.where(iou_matrix > iou_threshold), axis=1)
+    matched_indices = linear_assignment(iou_batch(detections, trackers), iou_threshold)
     unmatched_detections = np.setdiff1d(np.arange(len(detections)), matched_indices[:, 0])
     unmatched_trackers = np.setdiff1d(np.arange(len(trackers)), matched_indices[:, 1])
     return matched_indices, unmatched_detections, unmatched_trackers
 
 
 class Sort:
+    """
+    SORT over all tracks at once: states (N, 7) and covariances (N, 7, 7) live in contiguous arrays and
+    every Kalman predict / update is one batched NumPy operation, so the per-frame cost hardly grows with
+    the number of tracks. Same filter as one filterpy KalmanFilter per track (Joseph-form update), same outputs.
+    Track arrays are in creation order: x, P, ids, time_since_update, hits, hit_streak, age.
+    """
+
+    __slots__ = ('max_age', 'min_hits', 'iou_threshold', 'frame_count', 'next_id',
+                 'x', 'P', 'ids', 'time_since_update', 'hits', 'hit_streak', 'age')
+
     def __init__(self, max_age=15, min_hits=3, iou_threshold=0.3):
         self.max_age = max_age
         self.min_hits = min_hits
         self.iou_threshold = iou_threshold
-        self.trackers = []
         self.frame_count = 0
+        self.next_id = 0
+        self.x = np.empty((0, 7))
+        self.P = np.empty((0, 7, 7))
+        self.ids = np.empty(0, dtype=int)
+        self.time_since_update = np.empty(0, dtype=int)
+        self.hits = np.empty(0, dtype=int)
+        self.hit_streak = np.empty(0, dtype=int)
+        self.age = np.empty(0, dtype=int)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _keep(self, mask):
+        for name in ('x', 'P', 'ids', 'time_since_update', 'hits', 'hit_streak', 'age'):
+            setattr(self, name, getattr(self, name)[mask])
+
+    def _add(self, bboxes):
+        n = len(bboxes)
+        x = np.zeros((n, 7))
+        x[:, :4] = convert_bbox_to_z(bboxes)
+        self.x = np.concatenate([self.x, x])
+        self.P = np.concatenate([self.P, np.broadcast_to(KF_P0, (n, 7, 7))])
+        self.ids = np.concatenate([self.ids, np.arange(self.next_id, self.next_id + n)])
+        self.next_id += n
+        zeros = np.zeros(n, dtype=int)
+        self.time_since_update = np.concatenate([self.time_since_update, zeros])
+        self.hits = np.concatenate([self.hits, zeros])
+        self.hit_streak = np.concatenate([self.hit_streak, zeros])
+        self.age = np.concatenate([self.age, zeros])
+
+    def _kalman_predict(self):
+        self.x[self.x[:, 6] + self.x[:, 2] <= 0, 6] = 0.  # keep the predicted area positive
+        self.x = self.x @ KF_F.T
+        self.P = KF_F @ self.P @ KF_F.T + KF_Q
+
+    def _kalman_update(self, idx, z):
+        # H selects the first 4 state components, so H P H^T, P H^T and H x are slices
+        P = self.P[idx]
+        PHT = P[:, :, :4]
+        S = P[:, :4, :4] + KF_R
+        K = PHT @ np.linalg.inv(S)
+        self.x[idx] = self.x[idx] + (K @ (z - self.x[idx, :4])[:, :, None])[:, :, 0]
+        I_KH = np.broadcast_to(np.eye(7), P.shape).copy()
+        I_KH[:, :, :4] -= K
+        self.P[idx] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ KF_R @ K.transpose(0, 2, 1)
+
+    def _confirmed(self):
+        return (self.time_since_update < 1) & ((self.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
 
     def update(self, dets=np.empty((0, 5))):
         self.frame_count += 1
-        trks = np.zeros((len(self.trackers), 5))
-        to_del = []
-        ret = []
-        for t, trk in enumerate(trks):
-            pos = self.trackers[t].predict()[0]
-            trk[:] = [pos[0], pos[1], pos[2], pos[3], 0]
-            if np.any(np.isnan(pos)):
-                to_del.append(t)
-        trks = np.ma.compress_rows(np.ma.masked_invalid(trks))
-        for t in reversed(to_del):
-            self.trackers.pop(t)
+        self._kalman_predict()
+        self.age += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+        trks = convert_x_to_bbox(self.x)
+        valid = ~np.isnan(trks).any(axis=1)
+        if not valid.all():
+            self._keep(valid)
+            trks = trks[valid]
         matched, unmatched_dets, unmatched_trks = associate_detections_to_trackers(dets, trks, self.iou_threshold)
 
-        for m in matched:
-            self.trackers[m[1]].update(dets[m[0], :4])
-
-        for i in unmatched_dets:
-            trk = KalmanBoxTracker(dets[i, :4])
-            self.trackers.append(trk)
-
-        i = len(self.trackers)
-        for trk in reversed(self.trackers):
-            d = trk.get_state()[0]
-            if (trk.time_since_update < 1) and (trk.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
-                ret.append(np.concatenate((d, [trk.id + 1])).reshape(1, -1))
-            i -= 1
-            if trk.time_since_update > self.max_age:
-                self.trackers.pop(i)
-        if len(ret) > 0:
-            return np.concatenate(ret)
-        return np.empty((0, 5))
+        if len(matched):
+            t = matched[:, 1]
+            self._kalman_update(t, convert_bbox_to_z(dets[matched[:, 0], :4]))
+            self.time_since_update[t] = 0
+            self.hits[t] += 1
+            self.hit_streak[t] += 1
+
+        if len(unmatched_dets):
+            self._add(dets[unmatched_dets, :4])
+
+        # newest tracks first, like the original per-object loop
+        ret = np.hstack([convert_x_to_bbox(self.x), self.ids[:, None] + 1.])[self._confirmed()][::-1]
+        self._keep(self.time_since_update <= self.max_age)
+        return ret if len(ret) else np.empty((0, 5))
+
+    def predict(self):
+        """
+        Advance every tracker by one frame without detections (frame-stride mode).
+        Returns the predicted boxes of the tracks update() returned last time, in the same format.
+        The frame is not counted as a miss, so max_age and min_hits stay in detector frames.
+        """
+        self._kalman_predict()
+        boxes = convert_x_to_bbox(self.x)
+        keep = ~np.isnan(boxes).any(axis=1) & self._confirmed()
+        ret = np.hstack([boxes, self.ids[:, None] + 1.])[keep]
+        return ret if len(ret) else np.empty((0, 5))
@@ -0,0 +1,219 @@
+import os
+import json
+import time
+import threading
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pytest
+
+from download_manifest import DownloadManifest
+from downloader import DownloadStats, HostLimiter, download_many, download_to_file, make_session
+
+
+FILE_SIZE = 64 * 1024
+REQUEST_DELAY = 0.2  # seconds each request is held open, so concurrent requests overlap
+
+
+class CountingHandler(BaseHTTPRequestHandler):
+    """Serves FILE_SIZE bytes for any path and records how many requests each Host had open at once."""
+
+    def do_GET(self):
+        server = self.server
+        host = self.headers["Host"].split(":")[0]
+        with server.lock:
+            server.active[host] += 1
+            server.peak[host] = max(server.peak[host], server.active[host])
+            server.requests.append((host, time.monotonic()))
+        try:
+            time.sleep(REQUEST_DELAY)
+            body = self.path.encode().ljust(FILE_SIZE, b"x")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        finally:
+            with server.lock:
+                server.active[host] -= 1
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), CountingHandler)
+    httpd.daemon_threads = True
+    httpd.lock = threading.Lock()
+    httpd.active = defaultdict(int)
+    httpd.peak = defaultdict(int)
+    httpd.requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def make_jobs(host: str, port: int, folder, count: int, prefix: str = "file") -> list:
+    return [(f"http://{host}:{port}/{prefix}_{i}.mp4", os.path.join(folder, f"{prefix}_{i}.mp4"))
+            for i in range(count)]
+
+
+def test_download_many_runs_jobs_concurrently(server, tmp_path):
+    jobs = make_jobs("127.0.0.1", server.server_port, tmp_path, 8)
+    error_log = []
+    limiter = HostLimiter(limits={}, default_limit=(8, 0))
+
+    start = time.perf_counter()
+    results = list(download_many(jobs, timeout=10, error_log=error_log, max_workers=8, limiter=limiter))
+    elapsed = time.perf_counter() - start
+
+    assert error_log == []
+    assert sorted(results) == sorted((url, path, "downloaded") for url, path in jobs)
+    for url, path in jobs:
+        with open(path, "rb") as f:
+            data = f.read()
+        assert len(data) == FILE_SIZE
+        assert data.startswith(urlparse(url).path.encode())
+        assert not os.path.exists(path + ".part")
+    assert server.peak["127.0.0.1"] > 1
+    assert elapsed < len(jobs) * REQUEST_DELAY  # sequential downloads would take at least this long
+
+
+def test_host_limiter_caps_concurrency_per_host(server, tmp_path):
+    port = server.server_port
+    jobs = make_jobs("127.0.0.1", port, tmp_path, 6, "ip") + make_jobs("localhost", port, tmp_path, 6, "name")
+    limiter = HostLimiter(limits={"127.0.0.1": (2, 0), "localhost": (3, 0)})
+    error_log = []
+
+    results = list(download_many(jobs, timeout=10, error_log=error_log, max_workers=12, limiter=limiter))
+
+    assert error_log == []
+    assert [status for _, _, status in results] == ["downloaded"] * len(jobs)
+    assert server.peak["127.0.0.1"] == 2
+    assert server.peak["localhost"] == 3
+
+
+def test_host_limiter_spaces_requests_by_rate(server, tmp_path):
+    rate = 20.0
+    jobs = make_jobs("127.0.0.1", server.server_port, tmp_path, 6)
+    limiter = HostLimiter(limits={"127.0.0.1": (6, rate)})
+
+    list(download_many(jobs, timeout=10, error_log=[], max_workers=6, limiter=limiter))
+
+    starts = sorted(started for _, started in server.requests)
+    assert starts[-1] - starts[0] >= (len(jobs) - 1) / rate * 0.9
+
+
+def test_throughput_report(server, tmp_path, capsys):
+    jobs = make_jobs("127.0.0.1", server.server_port, tmp_path, 4)
+    jobs.append(("http://127.0.0.1:1/missing.mp4", os.path.join(tmp_path, "missing.mp4")))  # nothing listens there
+    stats = DownloadStats()
+    error_log = []
+    limiter = HostLimiter(limits={}, default_limit=(8, 0))
+
+    results = list(download_many(jobs, timeout=5, error_log=error_log, max_workers=4, stats=stats,
+                                 limiter=limiter))
+    # files already on disk but not in the manifest are adopted and counted as unchanged
+    manifest = DownloadManifest(os.path.join(tmp_path, "manifest.sqlite"))
+    try:
+        list(download_many(jobs[:2], timeout=5, error_log=[], max_workers=4, stats=stats, limiter=limiter,
+                           manifest=manifest))
+    finally:
+        manifest.close()
+    stats.finish()
+    capsys.readouterr()
+    stats.report("test")
+    out = capsys.readouterr().out
+
+    assert sum(status == "failed" for _, _, status in results) == 1
+    assert len(error_log) == 1
+    assert (stats.files, stats.bytes, stats.skipped, stats.failed) == (4, 4 * FILE_SIZE, 2, 1)
+    assert "Throughput (test): 4 files, 0.2 MB in" in out
+    assert "files/s" in out and "MB/s" in out
+    assert "(2 unchanged, 1 failed)" in out
+
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    """Serves server.body with server.etag, honouring Range only when If-Range still matches."""
+
+    def do_GET(self):
+        server = self.server
+        server.range_requests.append((self.headers.get("Range"), self.headers.get("If-Range")))
+        body, start = server.body, 0
+        if self.headers.get("Range") and self.headers.get("If-Range") == server.etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+        self.send_response(206 if start else 200)
+        self.send_header("ETag", server.etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        if start:
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        self.end_headers()
+        self.wfile.write(body[start:])
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def range_server():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    httpd.daemon_threads = True
+    httpd.body, httpd.etag = b"new" * 1000, '"v2"'
+    httpd.range_requests = []
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield httpd
+    httpd.shutdown()
+    httpd.server_close()
+    thread.join()
+
+
+def start_part(path, data: bytes, etag: str):
+    with open(path + ".part", "wb") as f:
+        f.write(data)
+    with open(path + ".part.json", "w") as f:
+        json.dump({"etag": etag, "last_modified": None}, f)
+
+
+def test_resume_appends_to_unchanged_remote_file(range_server, tmp_path):
+    path = os.path.join(tmp_path, "video.mp4")
+    start_part(path, range_server.body[:1000], '"v2"')
+
+    info = download_to_file(make_session(1), HostLimiter(limits={}, default_limit=(1, 0)),
+                            f"http://127.0.0.1:{range_server.server_port}/video.mp4", path, timeout=5)
+
+    assert range_server.range_requests == [("bytes=1000-", '"v2"')]
+    with open(path, "rb") as f:
+        assert f.read() == range_server.body
+    assert info["etag"] == '"v2"'
+    assert not os.path.exists(path + ".part") and not os.path.exists(path + ".part.json")
+
+
+def test_resume_restarts_when_remote_file_changed(range_server, tmp_path):
+    path = os.path.join(tmp_path, "video.mp4")
+    start_part(path, b"old" * 500, '"v1"')
+
+    download_to_file(make_session(1), HostLimiter(limits={}, default_limit=(1, 0)),
+                     f"http://127.0.0.1:{range_server.server_port}/video.mp4", path, timeout=5)
+
+    assert range_server.range_requests == [("bytes=1500-", '"v1"')]
+    with open(path, "rb") as f:
+        assert f.read() == range_server.body
+
+
+def test_part_without_validators_is_downloaded_again(range_server, tmp_path):
+    path = os.path.join(tmp_path, "video.mp4")
+    with open(path + ".part", "wb") as f:
+        f.write(b"old" * 500)
+
+    download_to_file(make_session(1), HostLimiter(limits={}, default_limit=(1, 0)),
+                     f"http://127.0.0.1:{range_server.server_port}/video.mp4", path, timeout=5)
+
+    assert range_server.range_requests == [(None, None)]
+    with open(path, "rb") as f:
+        assert f.read() == range_server.body
@@ -2,9 +2,50 @@ import os
 import cv2
 import time
 from ultralytics import YOLO
+from video_pool import VIDEO_WORKERS, longest_first, map_videos
 
 
-def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, imgsz: int = 640):
+def annotate_video(model, video_path: str, output_video_path: str, imgsz: int = 640):
+    """
+    Runs YOLO on every frame of one video and writes the annotated frames to output_video_path.
+    Returns (frame_count, seconds), or None if the video cannot be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
+
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
+
+    start_time = time.time()
+    frame_count = 0
+
+    while cap.isOpened():
+        ret, frame = cap.read()
+        if not ret:
+            break
+
+        # Run YOLO detection (with configurable image size)
+        results = model(frame, imgsz=imgsz)
+
+        # Use YOLO's built-in visualization (shows colors + class names)
+        annotated_frame = results[0].plot()
+
+        # Write the annotated frame to output video
+        out.write(annotated_frame)
+        frame_count += 1
+
+    cap.release()
+    out.release()
+    return frame_count, time.time() - start_time
+
+
+def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, imgsz: int = 640,
+                                  workers: int = VIDEO_WORKERS):
     """
     Runs YOLO detections on all videos in a folder.
     Saves annotated videos in a dedicated subfolder and prints progress/timing.
@@ -13,6 +54,8 @@ def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, i
         videos_folder (str): Path to folder containing videos.
         model_weights_path (str): Path to YOLO model weights.
         imgsz (int, optional): Image size for YOLO inference (default: 640).
+        workers (int, optional): Processes annotating videos in parallel, longest video first,
+            each with its own model (default: 1, everything in this process).
     """
 
     if not os.path.exists(videos_folder):
@@ -25,66 +68,38 @@ def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, i
     detected_videos_dir = os.path.join(os.path.dirname(videos_folder), "detected_videos_fine_tune_v2")
     os.makedirs(detected_videos_dir, exist_ok=True)
 
-    # Load YOLO model
-    print(f"Loading YOLO model from: {model_weights_path}")
-    model = YOLO(model_weights_path)
-
     video_files = [f for f in os.listdir(videos_folder) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
     total_videos = len(video_files)
     if not total_videos:
         print(f"No videos found in {videos_folder}")
         return
 
-    print(f"Running detections on {total_videos} videos...")
-
-    for idx, video_file in enumerate(video_files, start=1):
-        video_path = os.path.join(videos_folder, video_file)
-        print(f"[{idx}/{total_videos}] Processing video: {video_file}")
+    print(f"Running detections on {total_videos} videos (longest first)...")
+    jobs = [(video_file, (os.path.join(videos_folder, video_file), os.path.join(detected_videos_dir, video_file), imgsz))
+            for video_file in longest_first(videos_folder, video_files)]
 
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(f"Could not open video: {video_file}")
+    # Load YOLO model (once per worker process)
+    print(f"Loading YOLO model from: {model_weights_path}")
+    total_frames = done = 0
+    for idx, (video_file, result) in enumerate(map_videos(annotate_video, jobs, YOLO, model_weights_path, workers),
+                                               start=1):
+        if result is None:
+            print(f"[{idx}/{total_videos}] Could not open video: {video_file}")
             continue
-
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
-
-        output_video_path = os.path.join(detected_videos_dir, video_file)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
-
-        start_time = time.time()
-        frame_count = 0
-
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-
-            # Run YOLO detection (with configurable image size)
-            results = model(frame, imgsz=imgsz)
-
-            # Use YOLO's built-in visualization (shows colors + class names)
-            annotated_frame = results[0].plot()
-
-            # Write the annotated frame to output video
-            out.write(annotated_frame)
-            frame_count += 1
-
-        total_time = time.time() - start_time
-        print(f"\nFinished video {video_file}: {frame_count} frames in {total_time:.2f}s "
-              f"(avg {total_time/frame_count:.3f}s/frame)")
-
-        cap.release()
-        out.release()
+        frame_count, total_time = result
+        total_frames += frame_count
+        done += 1
+        print(f"\n[{idx}/{total_videos}] Finished video {video_file}: {frame_count} frames in {total_time:.2f}s "
+              f"(avg {total_time/max(1, frame_count):.3f}s/frame)")
 
     global_time_taken = (time.time() - global_start_time) / 60
-    print(f"\n{total_videos} videos processed in {global_time_taken:.2f} min.")
+    print(f"\n{done}/{total_videos} videos processed ({total_frames} frames) in {global_time_taken:.2f} min"
+          f" with {max(1, workers)} worker process(es).")
     print(f"Annotated videos saved in: {detected_videos_dir}")
 
 
-video_path = "media_for_detection_53/videos"
-model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt" 
+if __name__ == "__main__":
+    video_path = "media_for_detection_53/videos"
+    model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt" 
 
-run_yolo_detections_on_videos(videos_folder=video_path, model_weights_path=model_path)
\ No newline at end of file
+    run_yolo_detections_on_videos(videos_folder=video_path, model_weights_path=model_path)
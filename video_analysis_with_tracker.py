@@ -6,88 +6,62 @@ import torch
 from ultralytics import YOLO
 from ultralytics.engine.results import Boxes
 from sort import Sort 
+from detection_arrays import result_arrays
+from video_pool import VIDEO_WORKERS, longest_first, map_videos
 
 
-def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, imgsz: int = 640):
-    """
-    Runs YOLO detections on all videos in a folder,
-    applies SORT tracking (for temporal stability) but keeps only YOLO boxes & labels.
-    Filters out detections with confidence < 0.35.
-    """
-
-    if not os.path.exists(videos_folder):
-        print(f"Folder not found: {videos_folder}")
-        return
+BATCH_SIZE = 8  # frames per model call
 
-    global_start_time = time.time()
 
-    detected_videos_dir = os.path.join(os.path.dirname(videos_folder), "detected_videos_with_tracking_fine_tuneV2")
-    os.makedirs(detected_videos_dir, exist_ok=True)
-
-    print(f"Loading YOLO model from: {model_weights_path}")
-    model = YOLO(model_weights_path)
-
-    video_files = [f for f in os.listdir(videos_folder) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
-    total_videos = len(video_files)
-    if not total_videos:
-        print(f"No videos found in {videos_folder}")
-        return
-
-    print(f"Running detections on {total_videos} videos...")
-
-    for idx, video_file in enumerate(video_files, start=1):
-        video_path = os.path.join(videos_folder, video_file)
-        print(f"[{idx}/{total_videos}] Processing video: {video_file}")
-
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(f"Could not open video: {video_file}")
-            continue
+def annotate_video(model, video_path: str, output_video_path: str, imgsz: int = 640,
+                   batch_size: int = BATCH_SIZE):
+    """
+    Runs YOLO + SORT on one video and writes the frames annotated with the filtered YOLO boxes
+    to output_video_path. Returns (frame_count, seconds), or None if the video cannot be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None
 
-        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS)
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS)
 
-        output_video_path = os.path.join(detected_videos_dir, video_file)
-        fourcc = cv2.VideoWriter_fourcc(*'mp4v')
-        out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')
+    out = cv2.VideoWriter(output_video_path, fourcc, fps, (width, height))
 
-        start_time = time.time()
-        frame_count = 0
+    start_time = time.time()
+    frame_count = 0
 
-        tracker = Sort(max_age=20, min_hits=2, iou_threshold=0.3)
-        CONF_THRESHOLD = 0.35
+    tracker = Sort(max_age=20, min_hits=2, iou_threshold=0.3)
+    CONF_THRESHOLD = 0.35
 
-        while cap.isOpened():
+    while cap.isOpened():
+        frames = []
+        while len(frames) < max(1, batch_size):
             ret, frame = cap.read()
             if not ret:
                 break
+            frames.append(frame)
+        if not frames:
+            break
 
-            # Run YOLO detection
-            results = model(frame, imgsz=imgsz, verbose=False)
-            det = results[0]
+        # Run YOLO detection on the whole batch in one call
+        results = model(frames, imgsz=imgsz, verbose=False)
 
-            detections_for_sort = []
-            filtered_boxes = []
+        for det in results:
+            # Filter by confidence on the arrays, in one vectorized step
+            xyxy, conf, _ = result_arrays(det, CONF_THRESHOLD)
 
-            if det.boxes is not None and len(det.boxes) > 0:
-                for box in det.boxes:
-                    x1, y1, x2, y2 = box.xyxy[0].tolist()
-                    conf = float(box.conf)
-                    if conf >= CONF_THRESHOLD:
-                        detections_for_sort.append([x1, y1, x2, y2, conf])
-                        filtered_boxes.append(box)
-
-            # Update tracker (for smoother temporal behavior)
-            if len(detections_for_sort) > 0:
-                tracker.update(np.array(detections_for_sort))
+            # Update tracker in frame order (for smoother temporal behavior)
+            if len(conf) > 0:
+                tracker.update(np.hstack([xyxy, conf[:, None]]))
             else:
                 tracker.update()
 
             # Replace YOLO’s boxes with the filtered subset
-            if filtered_boxes:
-                stacked = torch.stack([b.data[0] for b in filtered_boxes])
-                det.boxes = Boxes(stacked, det.orig_img.shape[:2]) 
+            if det.boxes is not None and len(det.boxes) > 0:
+                det.boxes = det.boxes[det.boxes.conf >= CONF_THRESHOLD]
             else:
                 det.boxes = Boxes(torch.empty((0, 6)), det.orig_img.shape[:2])
 
@@ -97,20 +71,63 @@ def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, i
             out.write(annotated_frame)
             frame_count += 1
 
-        total_time = time.time() - start_time
-        print(f"\nFinished {video_file}: {frame_count} frames in {total_time:.2f}s "
-              f"(avg {total_time/frame_count:.3f}s/frame)")
+    cap.release()
+    out.release()
+    return frame_count, time.time() - start_time
+
+
+def run_yolo_detections_on_videos(videos_folder: str, model_weights_path: str, imgsz: int = 640,
+                                  batch_size: int = BATCH_SIZE, workers: int = VIDEO_WORKERS):
+    """
+    Runs YOLO detections on all videos in a folder,
+    applies SORT tracking (for temporal stability) but keeps only YOLO boxes & labels.
+    Filters out detections with confidence < 0.35.
+    Frames go to the model batch_size at a time; results are tracked and written in frame order.
+    With workers > 1, videos are annotated in that many processes (one model each), longest first.
+    """
+
+    if not os.path.exists(videos_folder):
+        print(f"Folder not found: {videos_folder}")
+        return
+
+    global_start_time = time.time()
+
+    detected_videos_dir = os.path.join(os.path.dirname(videos_folder), "detected_videos_with_tracking_fine_tuneV2")
+    os.makedirs(detected_videos_dir, exist_ok=True)
 
-        cap.release()
-        out.release()
+    video_files = [f for f in os.listdir(videos_folder) if f.lower().endswith(('.mp4', '.mov', '.avi'))]
+    total_videos = len(video_files)
+    if not total_videos:
+        print(f"No videos found in {videos_folder}")
+        return
+
+    print(f"Running detections on {total_videos} videos (longest first)...")
+    jobs = [(video_file, (os.path.join(videos_folder, video_file), os.path.join(detected_videos_dir, video_file),
+                          imgsz, batch_size))
+            for video_file in longest_first(videos_folder, video_files)]
+
+    print(f"Loading YOLO model from: {model_weights_path}")
+    total_frames = done = 0
+    for idx, (video_file, result) in enumerate(map_videos(annotate_video, jobs, YOLO, model_weights_path, workers),
+                                               start=1):
+        if result is None:
+            print(f"[{idx}/{total_videos}] Could not open video: {video_file}")
+            continue
+        frame_count, total_time = result
+        total_frames += frame_count
+        done += 1
+        print(f"\n[{idx}/{total_videos}] Finished {video_file}: {frame_count} frames in {total_time:.2f}s "
+              f"(avg {total_time/max(1, frame_count):.3f}s/frame)")
 
     global_time_taken = (time.time() - global_start_time) / 60
-    print(f"\n{total_videos} videos processed in {global_time_taken:.2f} min.")
+    print(f"\n{done}/{total_videos} videos processed ({total_frames} frames) in {global_time_taken:.2f} min"
+          f" with {max(1, workers)} worker process(es).")
     print(f"Annotated videos saved in: {detected_videos_dir}")
 
 
-# === CONFIG ===
-video_path = "media_for_detection_53/videos"
-model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt" 
+if __name__ == "__main__":
+    # === CONFIG ===
+    video_path = "media_for_detection_53/videos"
+    model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt" 
 
-run_yolo_detections_on_videos(videos_folder=video_path, model_weights_path=model_path)
+    run_yolo_detections_on_videos(videos_folder=video_path, model_weights_path=model_path)
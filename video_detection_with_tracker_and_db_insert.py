@@ -1,5 +1,5 @@
 import os
-import json
+import sys
 import time
 from datetime import timedelta
 from typing import Dict, List, Tuple, Any
@@ -8,15 +8,16 @@ import cv2
 import numpy as np
 from ultralytics import YOLO
 
-from sort import Sort 
-from dc_utils import mysql_execute_insert
+from sort import Sort, iou_batch, linear_assignment
+from video_proxy import load_proxy_info
+from detection_writer import AsyncDetectionWriter, DB_FLUSH_SIZE, DB_FLUSH_INTERVAL, SPILL_PATH
+from detection_arrays import result_arrays, class_names, size_categories
+from detection_ledger import CompletionLedger, LEDGER_FILE, pending_media
+from frame_ring import FrameRing, RING_SLOTS
+from video_pool import VIDEO_WORKERS, map_videos, video_length
 
-# ---------- SQL for inserting track-level rows ----------
-INSERT_SQL_VIDEO = """
-INSERT INTO yolo_video_detection
-(study_id, media_id, plateform_id, logo, size, area, areaPercentage, timeBegin, timeEnd, confidence, x1, y1, x2, y2)
-VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-"""
+# ---------- Target table for track-level rows (columns in result_sinks.TABLE_SCHEMAS) ----------
+VIDEO_TABLE = "yolo_video_detection"
 
 # ---------- Configurable thresholds ----------
 CONF_THRESHOLD = 0.35
@@ -25,6 +26,20 @@ MIN_VISIBLE_FRAMES = 3
 MAX_INACTIVE_FRAMES = 10 
 IOU_MATCH_THRESHOLD = 0.5
 
+# ---------- Frame stride (detector every N frames, Kalman prediction in between) ----------
+DETECT_STRIDE = 1            # 1 = detector on every frame
+ADAPTIVE_STRIDE = False      # vary the stride between 1 and DETECT_STRIDE from track motion and confidence
+MAX_STRIDE_MOTION = 0.2      # adaptive: max predicted motion per detector step, as a fraction of the box size
+LOW_CONF_FOR_STRIDE = 0.5    # adaptive: a detection below this confidence halves the stride
+
+# ---------- Batching ----------
+VIDEO_BATCH_SIZE = 8         # detector frames per model call
+
+# ---------- Chunked videos (one video split across worker processes) ----------
+CHUNK_SECONDS = 0            # split videos longer than this into chunks of this length; 0 = never split
+CHUNK_OVERLAP_S = 2.0        # seconds processed by both neighbouring chunks, where tracks are stitched
+STITCH_IOU = 0.5             # min mean box IoU over the overlap for two tracks to be the same appearance
+
 # ---------- Helpers ----------
 def parse_filename(file_name: str) -> Tuple[int, str, int]:
     """Parse filename like 53_33731469523_1219967756810240_6.mp4 -> (study_id, media_id, plateform_id)"""
@@ -50,21 +65,23 @@ def iou_bbox(a: Tuple[float, float, float, float], b: Tuple[float, float, float,
     union = area_a + area_b - inter
     return inter / union if union > 0 else 0.0
 
-def match_tracks_to_detections(tracks: np.ndarray, detections: List[Dict[str, Any]]) -> Dict[int, Dict[str, Any]]:
-    """Match each SORT track to the best YOLO detection based on IoU."""
-    mapping: Dict[int, Dict[str, Any]] = {}
-    det_boxes = [(d['box']['x1'], d['box']['y1'], d['box']['x2'], d['box']['y2']) for d in detections]
-    for t in tracks:
-        tx1, ty1, tx2, ty2, tid = float(t[0]), float(t[1]), float(t[2]), float(t[3]), int(t[4])
-        best_iou, best_idx = 0.0, -1
-        for i, db in enumerate(det_boxes):
-            iou_val = iou_bbox((tx1, ty1, tx2, ty2), db)
-            if iou_val > best_iou:
-                best_iou, best_idx = iou_val, i
-        if best_idx >= 0 and best_iou >= IOU_MATCH_THRESHOLD:
-            mapping[tid] = detections[best_idx]
+def match_tracks_to_detections(tracks: np.ndarray, det_xyxy: np.ndarray, det_conf: np.ndarray,
+                               det_names: List[str]) -> Dict[int, Tuple[Tuple[float, float, float, float], Any, float]]:
+    """
+    Match SORT tracks to YOLO detections one-to-one, maximizing the total IoU (sort.linear_assignment)
+    -> {track_id: (box, name, confidence)}; unmatched tracks keep their own box, with no name and no confidence.
+    """
+    mapping: Dict[int, Tuple[Tuple[float, float, float, float], Any, float]] = {}
+    det_boxes = [tuple(b) for b in det_xyxy.tolist()]
+    det_confs = det_conf.tolist()
+    matches = dict(linear_assignment(iou_batch(tracks, det_xyxy), IOU_MATCH_THRESHOLD).tolist())
+    for row, t in enumerate(tracks.tolist()):
+        tid = int(t[4])
+        if row in matches:
+            best_idx = matches[row]
+            mapping[tid] = (det_boxes[best_idx], det_names[best_idx], det_confs[best_idx])
         else:
-            mapping[tid] = {'box': {'x1': tx1,'y1': ty1,'x2': tx2,'y2': ty2}, 'name': None, 'confidence': 0.0}
+            mapping[tid] = (tuple(t[:4]), None, 0.0)
     return mapping
 
 # ---------- Track data management ----------
@@ -77,27 +94,31 @@ def make_empty_track_entry(track_id: int, first_frame_idx: int, first_time_s: fl
         'end_time_s': first_time_s,
         'last_seen_frame': first_frame_idx,
         'frames_seen': 0,
+        'frame_indices': [],
         'positions': [],
         'confidences': [],
         'logos': [],
         'max_confidence': 0.0
     }
 
-def update_track_with_detection(track: Dict[str, Any], det: Dict[str, Any], frame_idx: int, time_s: float):
-    box = det.get('box', {})
-    x1, y1, x2, y2 = box.get('x1',0.0), box.get('y1',0.0), box.get('x2',0.0), box.get('y2',0.0)
-    conf = float(det.get('confidence', 0.0) or 0.0)
-    name = det.get('name')
+def update_track_with_detection(track: Dict[str, Any], box: Tuple[float, float, float, float], name: Any,
+                                conf: float, frame_idx: int, time_s: float):
+    x1, y1, x2, y2 = box
     track['end_frame'] = frame_idx
     track['end_time_s'] = time_s
     track['last_seen_frame'] = frame_idx
     track['frames_seen'] += 1
+    track['frame_indices'].append(frame_idx)
     track['positions'].append((x1, y1, x2, y2))
     track['confidences'].append(conf)
     track['logos'].append(name)
     if conf > track['max_confidence']:
         track['max_confidence'] = conf
 
+def majority_logo(logos: List[Any]) -> Any:
+    logos = [l for l in logos if l is not None]
+    return max(set(logos), key=logos.count) if logos else None
+
 def aggregate_track_for_db(track: Dict[str, Any], img_width: int, img_height: int,
                            study_id: int, media_id: str, plateform_id: int) -> Tuple:
     max_idx = int(np.argmax(track['confidences'])) if track['confidences'] else 0
@@ -108,17 +129,9 @@ def aggregate_track_for_db(track: Dict[str, Any], img_width: int, img_height: in
     area = width*height
     frame_area = img_width*img_height if img_width>0 and img_height>0 else 1
     area_percentage = (area/frame_area)*100.0
-    if area_percentage >= 10.0:
-        size_str = "large"
-    elif area_percentage >= 1.0:
-        size_str = "meduim"
-    elif area_percentage >= 0.1:
-        size_str = "small"
-    else:
-        size_str = "tiny"
+    size_str = size_categories(np.array([area_percentage]), "tiny")[0]
     confidence = track.get('max_confidence',0.0)
-    logos = [l for l in track['logos'] if l is not None]
-    logo_value = max(set(logos), key=logos.count) if logos else None
+    logo_value = majority_logo(track['logos'])
     # convert seconds to time(3) string hh:mm:ss.ms
     def sec_to_timestr(s: float) -> str:
         ms = int((s - int(s))*1000)
@@ -129,93 +142,436 @@ def aggregate_track_for_db(track: Dict[str, Any], img_width: int, img_height: in
     return (study_id, media_id, plateform_id, logo_value, size_str, area, area_percentage,
             time_begin_str, time_end_str, confidence, x1, y1, x2, y2)
 
-def insert_track_to_db(values: Tuple, specific_config='default'):
+# ---------- Frame stride ----------
+def next_stride(tracker: Sort, det_conf: np.ndarray, stride: int, max_stride: int) -> int:
+    """
+    Adaptive stride: halve it when a track moves more than MAX_STRIDE_MOTION of its size per detector step,
+    a track was missed on this detector frame or a detection is below LOW_CONF_FOR_STRIDE,
+    otherwise grow it by one frame up to max_stride.
+    """
+    x = tracker.x
+    size = np.sqrt(np.maximum(x[:, 2], 1.0))  # x[:, 2] is the box area
+    motion = float((np.hypot(x[:, 4], x[:, 5]) / size).max()) if len(x) else 0.0
+    missed = bool((tracker.time_since_update > 0).any())
+    if motion * stride > MAX_STRIDE_MOTION or missed or (len(det_conf) and det_conf.min() < LOW_CONF_FOR_STRIDE):
+        return max(1, stride // 2)
+    return min(max_stride, stride + 1)
+
+# ---------- Per-video tracking ----------
+def track_video_segment(model, video_path: str, imgsz: int = 640, detect_stride: int = DETECT_STRIDE,
+                        adaptive_stride: bool = ADAPTIVE_STRIDE, batch_size: int = VIDEO_BATCH_SIZE,
+                        ring_slots: int = RING_SLOTS, start_frame: int = 1, end_frame: int = None,
+                        owned_end: int = None):
+    """
+    Detect and track logos through frames start_frame..end_frame (1-based, inclusive; None = to the end) of a video.
+    Returns (tracks, (width, height), stats), or (None, None, stats) if the video cannot be opened: every track
+    entry in the order tracks ended, valid or not, so that tracks cut at a chunk boundary can be stitched.
+    The detector runs every detect_stride frames (with adaptive_stride, every 1..detect_stride frames depending
+    on track motion and confidence). In between, SORT's Kalman filter predicts the tracks frame by frame, which
+    keeps them active; only detector frames count toward frames_seen (MIN_VISIBLE_FRAMES), and tracks begin
+    and end on detector frames. Detector frames go to the model batch_size at a time and
+    the results are fed to SORT in frame order (with adaptive_stride, a new stride applies from the next batch).
+    Frames are decoded ahead on a decoder thread into a ring of ring_slots reused buffers (frame_ring.FrameRing);
+    stats has the time spent per stage (see format_utilization) and the start / end wall clock of the segment;
+    its frame counts stop at owned_end, so a chunk's overlap with the next chunk is only counted once.
+    """
+    stats = {"frames": 0, "detector_frames": 0}
+    video_start = time.time()
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return None, None, stats
+    tracks = []
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    # Analysis proxy: boxes are scaled back so DB rows stay in original-resolution terms
+    proxy_info = load_proxy_info(video_path)
+    scale_x = scale_y = 1.0
+    if proxy_info:
+        scale_x, scale_y = proxy_info['scale_x'], proxy_info['scale_y']
+        width, height = proxy_info['orig_width'], proxy_info['orig_height']
+    box_scale = np.array([scale_x, scale_y, scale_x, scale_y])
+    detect_stride = max(1, detect_stride)
+    # SORT ages tracks in detector frames: keep its patience at about MAX_INACTIVE_FRAMES video frames.
+    # A missed detection hides a track for one stride and re-confirming it (min_hits=2) for another, and a
+    # track is last seen on a detector frame, up to one stride before the frames predicted after it,
+    # so our own inactivity limit gets three strides of slack.
+    tracker = Sort(max_age=max(1, MAX_INACTIVE_FRAMES // detect_stride), min_hits=2, iou_threshold=IOU_MATCH_THRESHOLD)
+    max_inactive = MAX_INACTIVE_FRAMES + 3 * (detect_stride - 1)
+    active_tracks: Dict[int, Dict[str, Any]] = {}
+    start_frame = max(1, start_frame)
+    frame_idx = start_frame - 1
+    stride = detect_stride
+    next_detect = start_frame
+    batch_size = max(1, batch_size)
+    infer_time = track_time = 0.0
+    # With a fixed stride the decoder only decodes detector frames and grabs the others; the adaptive
+    # schedule is only known after each batch, so every frame is decoded and the unused ones are released.
+    wanted = None if adaptive_stride or detect_stride == 1 else (lambda idx: (idx - start_frame) % detect_stride == 0)
+    # the batch being assembled holds batch_size buffers, the decoder needs at least one more to run ahead
+    ring = FrameRing(cap, slots=max(ring_slots, batch_size + 1), wanted=wanted, first_frame=start_frame,
+                     last_frame=end_frame)
+    eof = False
     try:
-        mysql_execute_insert(INSERT_SQL_VIDEO, values, specific_config=specific_config)
-    except Exception as e:
-        print(f"DB insert failed: {e}, values={values}")
+        while not eof:
+            # Take frames from the decoder until batch_size detector frames are buffered
+            pending = []  # (frame_idx, frame or None for a prediction-only frame, ring slot), in frame order
+            n_detect = last_detect = 0
+            while n_detect < batch_size:
+                item = ring.get()
+                if item is None:
+                    eof = True
+                    break
+                idx, frame, slot = item
+                if idx >= next_detect:
+                    n_detect += 1
+                    last_detect = idx
+                    next_detect = idx + stride
+                elif slot is not None:
+                    ring.release(slot)
+                    frame = slot = None
+                pending.append((idx, frame, slot))
+            # One model call for every detector frame of the batch
+            start = time.time()
+            batch_frames = [frame for _, frame, _ in pending if frame is not None]
+            batch_results = iter(model(batch_frames, imgsz=imgsz, verbose=False) if batch_frames else [])
+            infer_time += time.time() - start
+            # Tracking consumes the batch strictly in frame order, as if frames came one by one
+            start = time.time()
+            for frame_idx, frame, slot in pending:
+                frame_time_s = (frame_idx-1)/fps
+                if frame is not None:
+                    det = next(batch_results)
+                    # filtered detections, as arrays in original-resolution coordinates
+                    det_xyxy, det_conf, det_cls = result_arrays(det, CONF_THRESHOLD)
+                    det_xyxy *= box_scale
+                    det_names = class_names(det, det_cls)
+                    tracks_np = tracker.update(np.hstack([det_xyxy, det_conf[:, None]])) if len(det_conf) else tracker.update()
+                    mapping = match_tracks_to_detections(tracks_np, det_xyxy, det_conf, det_names) if len(tracks_np)>0 else {}
+                    if owned_end is None or frame_idx <= owned_end:
+                        stats["detector_frames"] += 1
+                    if adaptive_stride:
+                        stride = next_stride(tracker, det_conf, stride, detect_stride)
+                        tracker.max_age = max(1, MAX_INACTIVE_FRAMES // stride)
+                    seen_ids = set(mapping)
+                else:
+                    # Kalman prediction keeps the tracks active between detector frames but is not a detection:
+                    # it adds nothing to frames_seen and does not move a track's start or end
+                    mapping = {}
+                    seen_ids = {int(t[4]) for t in tracker.predict()}
+                for tid, (box, name, conf) in mapping.items():
+                    if tid not in active_tracks:
+                        active_tracks[tid] = make_empty_track_entry(tid, frame_idx, frame_time_s)
+                    update_track_with_detection(active_tracks[tid], box, name, conf, frame_idx, frame_time_s)
+                # finalize inactive tracks
+                to_finalize = [tid for tid,t in active_tracks.items() if tid not in seen_ids and (frame_idx - t['last_seen_frame'])>max_inactive]
+                for tid in to_finalize:
+                    tracks.append(active_tracks.pop(tid))
+            for _, _, slot in pending:
+                ring.release(slot)
+            track_time += time.time() - start
+            if adaptive_stride and last_detect:
+                # within a batch the schedule is fixed; the adapted stride applies from the next batch
+                next_detect = last_detect + stride
+    finally:
+        ring.close()
+        cap.release()
+    # finalize remaining tracks
+    tracks.extend(active_tracks.values())
+    stats["frames"] = max(0, (frame_idx if owned_end is None else min(frame_idx, owned_end)) - (start_frame - 1))
+    video_end = time.time()
+    stats.update(started_at=video_start, ended_at=video_end, wall_s=video_end - video_start,
+                 decode_s=ring.decode_time, infer_s=infer_time, track_s=track_time,
+                 decoder_blocked_s=ring.blocked_time, infer_wait_s=ring.wait_time)
+    return tracks, (width, height), stats
+
+def track_rows(tracks: List[Dict[str, Any]], size: Tuple[int, int], study_id: int, media_id: str,
+               plateform_id: int) -> List[Tuple]:
+    """DB rows of the valid tracks (seen on enough frames, confident enough)."""
+    width, height = size
+    return [aggregate_track_for_db(t, width, height, study_id, media_id, plateform_id) for t in tracks
+            if t['frames_seen']>=MIN_VISIBLE_FRAMES and t['max_confidence']>=MIN_CONF_FOR_VALID_TRACK]
+
+def track_video(model, video_path: str, study_id: int, media_id: str, plateform_id: int, imgsz: int = 640,
+                detect_stride: int = DETECT_STRIDE, adaptive_stride: bool = ADAPTIVE_STRIDE,
+                batch_size: int = VIDEO_BATCH_SIZE, ring_slots: int = RING_SLOTS):
+    """
+    Detect and track logos through one video (see track_video_segment);
+    returns (track rows, stats) or (None, stats) if it cannot be opened.
+    """
+    tracks, size, stats = track_video_segment(model, video_path, imgsz, detect_stride, adaptive_stride,
+                                              batch_size, ring_slots)
+    if tracks is None:
+        return None, stats
+    return track_rows(tracks, size, study_id, media_id, plateform_id), stats
+
+# ---------- Chunked videos ----------
+def chunk_ranges(frame_count: int, fps: float, chunk_seconds: float = CHUNK_SECONDS,
+                 overlap_seconds: float = CHUNK_OVERLAP_S, stride: int = DETECT_STRIDE) -> List[Tuple[int, Any]]:
+    """
+    (start_frame, end_frame) ranges cutting a video into chunk_seconds chunks, each one also covering the first
+    overlap_seconds of the next (end_frame None = to the end). Chunk starts stay on the detector stride.
+    Unknown lengths, videos shorter than about two chunks and chunk_seconds <= 0 give the whole video.
+    """
+    if chunk_seconds <= 0 or frame_count <= 0 or fps <= 0:
+        return [(1, None)]
+    stride = max(1, stride)
+    step = max(1, int(round(chunk_seconds * fps / stride))) * stride
+    # the next chunk's SORT needs a few detector frames in the overlap to confirm its tracks
+    overlap = max(4 * stride, int(round(overlap_seconds * fps)))
+    ranges, start = [], 1
+    while start + step + overlap < frame_count:
+        ranges.append((start, start + step + overlap - 1))
+        start += step
+    ranges.append((start, None))
+    return ranges
+
+def overlap_iou(a: Dict[str, Any], b: Dict[str, Any], first: int, last: int) -> float:
+    """Mean box IoU of two tracks over the frames of first..last where both have a box (0 if none)."""
+    a_boxes = {f: box for f, box in zip(a['frame_indices'], a['positions']) if first <= f <= last}
+    ious = [iou_bbox(a_boxes[f], box) for f, box in zip(b['frame_indices'], b['positions']) if f in a_boxes]
+    return float(np.mean(ious)) if ious else 0.0
+
+def merge_tracks(track: Dict[str, Any], continuation: Dict[str, Any]):
+    """Extend track in place with the frames of continuation that come after its own last frame."""
+    after = [i for i, f in enumerate(continuation['frame_indices']) if f > track['end_frame']]
+    if not after:
+        return
+    for key in ('frame_indices', 'positions', 'confidences', 'logos'):
+        track[key].extend(continuation[key][i] for i in after)
+    track['end_frame'] = track['last_seen_frame'] = continuation['frame_indices'][after[-1]]
+    track['end_time_s'] = continuation['end_time_s']
+    track['frames_seen'] += len(after)
+    track['max_confidence'] = max(track['max_confidence'], max(continuation['confidences'][i] for i in after))
+
+def stitch_tracks(tracks: List[Dict[str, Any]], next_tracks: List[Dict[str, Any]],
+                  overlap_first: int, overlap_last: int) -> List[Dict[str, Any]]:
+    """
+    Join the tracks of two consecutive chunks sharing frames overlap_first..overlap_last.
+    A track still alive in the overlap and a track of the next chunk born in it are the same appearance when
+    their logos agree and their mean box IoU over the common frames is >= STITCH_IOU; best pairs are merged first.
+    Within the overlap the earlier chunk is kept (its tracker has the history), so unmatched tracks of the
+    next chunk that do not outlive the overlap are dropped as duplicates.
+    """
+    ending = [a for a in tracks if a['end_frame'] >= overlap_first]
+    starting = [b for b in next_tracks if b['start_frame'] <= overlap_last]
+    pairs = []
+    for i, a in enumerate(ending):
+        for j, b in enumerate(starting):
+            logo_a, logo_b = majority_logo(a['logos']), majority_logo(b['logos'])
+            if logo_a is not None and logo_b is not None and logo_a != logo_b:
+                continue
+            score = overlap_iou(a, b, overlap_first, overlap_last)
+            if score >= STITCH_IOU:
+                pairs.append((score, i, j))
+    used_a, used_b = set(), set()
+    for _, i, j in sorted(pairs, reverse=True):
+        if i not in used_a and j not in used_b:
+            used_a.add(i)
+            used_b.add(j)
+            merge_tracks(ending[i], starting[j])
+    merged = {id(starting[j]) for j in used_b}
+    return tracks + [b for b in next_tracks if id(b) not in merged and b['end_frame'] > overlap_last]
+
+def stitch_chunks(chunks: List[Tuple[int, Any]], chunk_tracks: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """Tracks of a whole video from the tracks of its chunk_ranges() chunks, in chunk order."""
+    tracks = chunk_tracks[0]
+    for (_, end_frame), (next_start, _), next_tracks in zip(chunks, chunks[1:], chunk_tracks[1:]):
+        tracks = stitch_tracks(tracks, next_tracks, next_start, end_frame)
+    return tracks
+
+# ---------- Stage utilization ----------
+PIPELINE_STAGES = (("decode", "decode_s"), ("inference", "infer_s"), ("tracking", "track_s"))
+
+def format_utilization(stats: Dict[str, float], db_time: float = None) -> str:
+    """Share of the wall time each stage was busy (track_video stats); the busiest stage is the bottleneck."""
+    wall = stats.get("wall_s", 0.0)
+    if wall <= 0:
+        return "Stage utilization: n/a"
+    parts = [f"{name} {stats.get(key, 0.0) / wall * 100:.0f}%" for name, key in PIPELINE_STAGES]
+    if db_time is not None:
+        parts.append(f"DB writer {db_time / wall * 100:.0f}%")
+    return (f"Stage utilization: {', '.join(parts)}"
+            f" (decoder blocked {stats.get('decoder_blocked_s', 0.0):.2f}s on a full ring,"
+            f" inference waited {stats.get('infer_wait_s', 0.0):.2f}s for frames)")
 
 # ---------- Main function ----------
-def run_yolo_videos_to_db(videos_folder: str, model_weights_path: str, imgsz: int = 640, db_config='default'):
+def run_yolo_videos_to_db(videos_folder: str, model_weights_path: str, imgsz: int = 640, db_config='default',
+                          flush_size: int = DB_FLUSH_SIZE, flush_interval: float = DB_FLUSH_INTERVAL,
+                          spill_path: str = SPILL_PATH, sink=None, force: bool = False, ledger_path: str = None,
+                          detect_stride: int = DETECT_STRIDE, adaptive_stride: bool = ADAPTIVE_STRIDE,
+                          batch_size: int = VIDEO_BATCH_SIZE, ring_slots: int = RING_SLOTS,
+                          workers: int = VIDEO_WORKERS, chunk_seconds: float = CHUNK_SECONDS,
+                          chunk_overlap_s: float = CHUNK_OVERLAP_S):
+    """
+    Track logos through every video of videos_folder and write one row per valid track to MySQL,
+    or to the result sink given by sink ("sqlite:<file>", "csv:<folder>", "parquet:<folder>").
+    Videos whose rows were already committed for the same content and weights (completion ledger at
+    ledger_path, next to the folder by default) are skipped unless force is set.
+    detect_stride / adaptive_stride / batch_size / ring_slots: see track_video (stride 1 = detector on every frame).
+    workers > 1 tracks videos in that many processes (one model each, see video_pool.map_videos), longest first;
+    their rows come back to this process and go through the same writer, sink and ledger.
+    chunk_seconds > 0 also splits videos longer than that into chunks overlapping by chunk_overlap_s, tracked
+    as separate jobs with their own SORT and stitched back (stitch_chunks), still one row per logo appearance.
+    """
     start_all = time.time()
     if not os.path.exists(videos_folder):
         print(f"Folder not found: {videos_folder}")
         return
-    model = YOLO(model_weights_path)
     video_files = [f for f in os.listdir(videos_folder) if f.lower().endswith(('.mp4','.mov','.avi'))]
     if not video_files:
         print("No videos found")
         return
-    for vid_idx, video_file in enumerate(video_files, start=1):
-        video_start = time.time()
-        print(f"\n Processing video {vid_idx}/{len(video_files)}: {video_file}")
-        video_path = os.path.join(videos_folder, video_file)
+    # Completion ledger: skip videos already committed with these weights
+    ledger = CompletionLedger(ledger_path or os.path.join(os.path.dirname(videos_folder), LEDGER_FILE),
+                              model_weights_path)
+    todo, skipped = pending_media(ledger, videos_folder, video_files, force)
+    if skipped:
+        print(f"Skipping {skipped} videos already in the completion ledger (use force=True to redo them)")
+    ledger_keys = dict(todo)
+    # One job per chunk (a single chunk unless chunk_seconds is set), longest first
+    video_ids, video_chunks, jobs = {}, {}, []
+    for video_file in ledger_keys:
         try:
-            study_id, media_id, plateform_id = parse_filename(video_file)
+            video_ids[video_file] = parse_filename(video_file)
         except Exception as e:
             print(f"Filename parsing failed: {e}")
             continue
-        cap = cv2.VideoCapture(video_path)
-        if not cap.isOpened():
-            print(f"Cannot open {video_file}")
-            continue
-        inserted_rows = 0
-        width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
-        tracker = Sort(max_age=MAX_INACTIVE_FRAMES, min_hits=2, iou_threshold=IOU_MATCH_THRESHOLD)
-        active_tracks: Dict[int, Dict[str, Any]] = {}
-        frame_idx = 0
-        while True:
-            ret, frame = cap.read()
-            if not ret: break
-            frame_idx +=1
-            frame_time_s = (frame_idx-1)/fps
-            results = model(frame, imgsz=imgsz, verbose=False)
-            det = results[0]
-            try:
-                det_list = json.loads(det.to_json())
-            except Exception:
-                det_list = []
-            # filtered detections
-            detections_for_sort, filtered_detections = [], []
-            for d in det_list:
-                conf = float(d.get('confidence',0.0) or 0.0)
-                if conf >= CONF_THRESHOLD:
-                    b = d['box']
-                    x1,y1,x2,y2 = float(b['x1']),float(b['y1']),float(b['x2']),float(b['y2'])
-                    detections_for_sort.append([x1,y1,x2,y2,conf])
-                    filtered_detections.append({'box':{'x1':x1,'y1':y1,'x2':x2,'y2':y2}, 'name':d.get('name'),'confidence':conf})
-            tracks_np = tracker.update(np.array(detections_for_sort)) if detections_for_sort else tracker.update()
-            mapping = match_tracks_to_detections(tracks_np, filtered_detections) if len(tracks_np)>0 else {}
-            seen_ids = set()
-            for tid, det_info in mapping.items():
-                seen_ids.add(tid)
-                if tid not in active_tracks:
-                    active_tracks[tid] = make_empty_track_entry(tid, frame_idx, frame_time_s)
-                update_track_with_detection(active_tracks[tid], det_info, frame_idx, frame_time_s)
-            # finalize inactive tracks
-            to_finalize = [tid for tid,t in active_tracks.items() if tid not in seen_ids and (frame_idx - t['last_seen_frame'])>MAX_INACTIVE_FRAMES]
-            for tid in to_finalize:
-                t = active_tracks.pop(tid)
-                if t['frames_seen']>=MIN_VISIBLE_FRAMES and t['max_confidence']>=MIN_CONF_FOR_VALID_TRACK:
-                    values = aggregate_track_for_db(t, width, height, study_id, media_id, plateform_id)
-                    insert_track_to_db(values, db_config)
-                    inserted_rows += 1
-        # finalize remaining tracks
-        for tid, t in list(active_tracks.items()):
-            if t['frames_seen']>=MIN_VISIBLE_FRAMES and t['max_confidence']>=MIN_CONF_FOR_VALID_TRACK:
-                values = aggregate_track_for_db(t, width, height, study_id, media_id, plateform_id)
-                insert_track_to_db(values, db_config)
-                inserted_rows += 1
-            active_tracks.pop(tid)
-        cap.release()
-        duration = time.time() - video_start
-        print(f" Finished {video_file}: inserted {inserted_rows} track rows."
-              f" Time taken: {duration:.2f} seconds. \n")
+        video_path = os.path.join(videos_folder, video_file)
+        frame_count, fps = video_length(video_path)
+        video_chunks[video_file] = chunk_ranges(frame_count, fps, chunk_seconds, chunk_overlap_s, detect_stride)
+        chunks = video_chunks[video_file]
+        for chunk_idx, (start_frame, end_frame) in enumerate(chunks):
+            length = (end_frame or frame_count) - start_frame + 1
+            # frames up to the next chunk's start are this chunk's own, the rest is overlap
+            owned_end = chunks[chunk_idx + 1][0] - 1 if chunk_idx + 1 < len(chunks) else None
+            jobs.append((length, (video_file, chunk_idx), (video_path, imgsz, detect_stride, adaptive_stride,
+                                                           batch_size, ring_slots, start_frame, end_frame,
+                                                           owned_end)))
+    jobs = [(name, args) for _, name, args in sorted(jobs, key=lambda job: job[0], reverse=True)]
+    # Track rows go to a background writer thread (multi-row INSERTs, flushed at the latest once per video);
+    # failed batches are spilled to spill_path for replay_spill(). A video is checkpointed in the ledger
+    # once all its rows are committed.
+    writer = AsyncDetectionWriter(flush_size, flush_interval, specific_config=db_config, spill_path=spill_path,
+                                  sink=sink, on_committed=ledger.mark_done)
+    totals: Dict[str, float] = {}
+    done = unopened = rows_queued = 0
+    chunk_results = {}
+    try:
+        print(f"Tracking {len(video_chunks)} videos in {len(jobs)} jobs, longest first")
+        for (video_file, chunk_idx), result in map_videos(track_video_segment, jobs, YOLO, model_weights_path,
+                                                          workers):
+            chunks = video_chunks[video_file]
+            chunk_results.setdefault(video_file, {})[chunk_idx] = result
+            if len(chunk_results[video_file]) < len(chunks):
+                continue
+            results = [result for _, result in sorted(chunk_results.pop(video_file).items())]
+            if any(tracks is None for tracks, _, _ in results):
+                print(f"Cannot open {video_file}")
+                unopened += 1
+                continue
+            # stage times add up over chunks; the video's own time is from its first chunk start to its last end
+            stats = {}
+            for _, _, chunk_stats in results:
+                for key, value in chunk_stats.items():
+                    if key not in ("started_at", "ended_at"):
+                        stats[key] = stats.get(key, 0) + value
+            elapsed = (max(chunk_stats["ended_at"] for _, _, chunk_stats in results)
+                       - min(chunk_stats["started_at"] for _, _, chunk_stats in results))
+            tracks = stitch_chunks(chunks, [tracks for tracks, _, _ in results])
+            video_rows = track_rows(tracks, results[0][1], *video_ids[video_file])
+            # all rows of the video in one submit, so a crash mid-video leaves nothing half-inserted
+            writer.submit(VIDEO_TABLE, video_rows, key=ledger_keys[video_file])
+            writer.flush()
+            done += 1
+            rows_queued += len(video_rows)
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+            print(f"\n Finished video {done + unopened}/{len(video_chunks)}: {video_file}:"
+                  f" queued {len(video_rows)} track rows."
+                  f" Detector ran on {stats['detector_frames']}/{stats['frames']} frames"
+                  f"{f' in {len(chunks)} chunks' if len(chunks) > 1 else ''}."
+                  f" Time taken: {elapsed:.2f} seconds.")
+            print(f" {format_utilization(stats)}")
+    finally:
+        # drain on errors too: rows of finished videos are committed and checkpointed
+        print("Waiting for the DB writer to drain...")
+        writer.close()
+        ledger.close()
     total_duration = time.time() - start_all
+    print(f"\nSummary: {done} videos tracked ({unopened} could not be opened, {skipped} skipped),"
+          f" {rows_queued} track rows, detector on {int(totals.get('detector_frames', 0))}"
+          f"/{int(totals.get('frames', 0))} frames, {max(1, workers)} worker process(es).")
+    if totals:
+        print(f"All videos - {format_utilization(totals, sum(w.db_time for w in writer.writers.values()))}")
     print(f"All videos processed in {total_duration:.2f} seconds.")
 
+# ---------- Stride benchmark ----------
+def timestr_to_sec(value: str) -> float:
+    hours, minutes, seconds = value.split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+def time_iou(a: Tuple, b: Tuple) -> float:
+    """Overlap of the [timeBegin, timeEnd] intervals of two track rows."""
+    a0, a1, b0, b1 = (timestr_to_sec(a[7]), timestr_to_sec(a[8]), timestr_to_sec(b[7]), timestr_to_sec(b[8]))
+    inter = max(0.0, min(a1, b1) - max(a0, b0))
+    union = max(a1, b1) - min(a0, b0)
+    return inter / union if union > 0 else float(a0 == b0)
+
+def compare_track_rows(reference: List[Tuple], rows: List[Tuple]) -> Dict[str, float]:
+    """Greedy match of rows to reference rows (same logo, time overlap >= 0.5): recall and timestamp drift."""
+    unmatched = list(rows)
+    matched, begin_drift, end_drift = 0, [], []
+    for ref in reference:
+        best, best_iou = None, 0.5
+        for row in unmatched:
+            overlap = time_iou(ref, row)
+            if row[3] == ref[3] and overlap >= best_iou:
+                best, best_iou = row, overlap
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+            begin_drift.append(abs(timestr_to_sec(best[7]) - timestr_to_sec(ref[7])))
+            end_drift.append(abs(timestr_to_sec(best[8]) - timestr_to_sec(ref[8])))
+    return {
+        "recall": matched / len(reference) if reference else 1.0,
+        "extra_rows": len(unmatched),
+        "begin_drift_s": float(np.mean(begin_drift)) if begin_drift else 0.0,
+        "end_drift_s": float(np.mean(end_drift)) if end_drift else 0.0,
+    }
+
+def benchmark_stride(videos_folder: str, model_weights_path: str, strides=(2, 3, 5), imgsz: int = 640,
+                     adaptive_stride: bool = False, batch_size: int = VIDEO_BATCH_SIZE):
+    """
+    Run every video at full rate and at each stride (nothing is written), and print the speedup
+    and how the track rows compare with the full-rate ones.
+    """
+    model = YOLO(model_weights_path)
+    video_files = [f for f in os.listdir(videos_folder) if f.lower().endswith(('.mp4','.mov','.avi'))]
+    for video_file in video_files:
+        video_path = os.path.join(videos_folder, video_file)
+        ids = parse_filename(video_file)
+        start = time.time()
+        reference, _ = track_video(model, video_path, *ids, imgsz=imgsz, detect_stride=1, batch_size=batch_size)
+        full_time = time.time() - start
+        if reference is None:
+            print(f"Cannot open {video_file}")
+            continue
+        print(f"\n{video_file}: full rate {full_time:.2f}s, {len(reference)} track rows")
+        for stride in strides:
+            start = time.time()
+            rows, stats = track_video(model, video_path, *ids, imgsz=imgsz, detect_stride=stride,
+                                      adaptive_stride=adaptive_stride, batch_size=batch_size)
+            elapsed = time.time() - start
+            cmp = compare_track_rows(reference, rows)
+            label = f"adaptive<={stride}" if adaptive_stride else f"stride {stride}"
+            print(f"  {label:>12}: {elapsed:.2f}s ({full_time / elapsed if elapsed else 0:.1f}x),"
+                  f" detector on {stats['detector_frames']}/{stats['frames']} frames, {len(rows)} rows,"
+                  f" recall {cmp['recall']*100:.0f}%, {cmp['extra_rows']} extra,"
+                  f" timeBegin drift {cmp['begin_drift_s']:.2f}s, timeEnd drift {cmp['end_drift_s']:.2f}s")
+
 if __name__=="__main__":
     video_path = "test_insert_db/videos"
     model_path = "models/team_chambe_3L_fine_tune_v2/weights/best.pt"
-    run_yolo_videos_to_db(videos_folder=video_path, model_weights_path=model_path, imgsz=640, db_config='default')
+    run_yolo_videos_to_db(videos_folder=video_path, model_weights_path=model_path, imgsz=640, db_config='default',
+                          force="--force" in sys.argv)
+    #benchmark_stride(videos_folder=video_path, model_weights_path=model_path)
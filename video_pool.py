@@ -0,0 +1,71 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Callable, Iterator, List, Tuple
+
+import cv2
+import torch
+
+
+VIDEO_WORKERS = 1  # processes, each with its own model; 1 = run in this process
+
+_worker_model = None
+
+
+def video_length(video_path: str) -> Tuple[int, float]:
+    """(frame count, fps) from the container header; (0, 0.0) if the video cannot be opened."""
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        return 0, 0.0
+    count, fps = int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), cap.get(cv2.CAP_PROP_FPS) or 0.0
+    cap.release()
+    return max(0, count), fps
+
+
+def frame_count(video_path: str) -> int:
+    return video_length(video_path)[0]
+
+
+def longest_first(videos_folder: str, video_files: List[str]) -> List[str]:
+    """Videos sorted by frame count, longest first, so the longest ones do not start last and straggle."""
+    counts = {video_file: frame_count(os.path.join(videos_folder, video_file)) for video_file in video_files}
+    return sorted(video_files, key=lambda video_file: counts[video_file], reverse=True)
+
+
+def threads_per_worker(workers: int) -> int:
+    """Torch intra-op threads per worker, so that the workers together use every core once."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def _init_worker(model_loader: Callable, model_weights_path: str, threads: int):
+    global _worker_model
+    torch.set_num_threads(threads)
+    _worker_model = model_loader(model_weights_path)
+
+
+def _run_job(task: Callable, args: Tuple):
+    return task(_worker_model, *args)
+
+
+def map_videos(task: Callable, jobs: List[Tuple[Any, Tuple]], model_loader: Callable, model_weights_path: str,
+               workers: int = VIDEO_WORKERS) -> Iterator[Tuple[Any, Any]]:
+    """
+    Run task(model, *args) for every (name, args) job and yield (name, result) as jobs finish.
+    With workers > 1 the jobs go to a process pool in the given order; each worker loads
+    model_loader(model_weights_path) once and gets threads_per_worker(workers) torch threads.
+    task and model_loader must be importable (module-level) so they can be sent to the workers.
+    """
+    if workers <= 1:
+        model = model_loader(model_weights_path)
+        for name, args in jobs:
+            yield name, task(model, *args)
+        return
+    threads = threads_per_worker(workers)
+    print(f"Starting {workers} worker processes with {threads} torch threads each")
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                               initargs=(model_loader, model_weights_path, threads))
+    try:
+        futures = {pool.submit(_run_job, task, args): name for name, args in jobs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,100 @@
+import os
+import json
+import shutil
+import subprocess
+from typing import Any, Dict, Optional, Tuple
+
+import cv2
+
+
+# ---------- CONFIG ----------
+
+PROXY_GOP = 15     # keyframe every 15 frames so seeking in the proxy stays cheap
+PROXY_CRF = 28
+SIDECAR_SUFFIX = ".proxy.json"
+
+
+# ---------- Helpers ----------
+def proxy_size(width: int, height: int, imgsz: int) -> Tuple[int, int]:
+    """Scale (width, height) so the long side is about imgsz, never upscaling, with even dimensions."""
+    scale = min(1.0, imgsz / float(max(width, height)))
+    return max(2, int(round(width * scale / 2)) * 2), max(2, int(round(height * scale / 2)) * 2)
+
+
+def sidecar_path(proxy_path: str) -> str:
+    return os.path.splitext(proxy_path)[0] + SIDECAR_SUFFIX
+
+
+def transcode_with_ffmpeg(src: str, dst: str, width: int, height: int):
+    """Resize, strip audio and force a short GOP with ffmpeg/libx264."""
+    cmd = [
+        "ffmpeg", "-y", "-loglevel", "error", "-i", src,
+        "-an", "-vf", f"scale={width}:{height}",
+        "-c:v", "libx264", "-preset", "veryfast", "-crf", str(PROXY_CRF),
+        "-g", str(PROXY_GOP), "-keyint_min", str(PROXY_GOP), "-sc_threshold", "0",
+        "-pix_fmt", "yuv420p", "-movflags", "+faststart", "-f", "mp4", dst,
+    ]
+    subprocess.run(cmd, check=True, capture_output=True)
+
+
+def transcode_with_opencv(src: str, dst: str, width: int, height: int, fps: float):
+    """Fallback when ffmpeg is not installed: resized mp4v copy (OpenCV never writes audio)."""
+    cap = cv2.VideoCapture(src)
+    out = cv2.VideoWriter(dst, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+    try:
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            out.write(cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA))
+    finally:
+        cap.release()
+        out.release()
+
+
+def make_proxy(video_path: str, proxy_folder: str, imgsz: int = 640) -> Optional[str]:
+    """
+    Transcode video_path once into a low-resolution analysis proxy in proxy_folder (same filename,
+    so parse_filename still works) and write a sidecar JSON with the original-to-proxy scale factors.
+    Returns the proxy path, or None if the source cannot be read.
+    """
+    cap = cv2.VideoCapture(video_path)
+    width, height = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25.0
+    cap.release()
+    if width <= 0 or height <= 0:
+        return None
+
+    os.makedirs(proxy_folder, exist_ok=True)
+    proxy_path = os.path.join(proxy_folder, os.path.basename(video_path))
+    root, ext = os.path.splitext(proxy_path)
+    tmp_path = root + ".tmp" + ext  # OpenCV picks the container from the extension
+    proxy_width, proxy_height = proxy_size(width, height, imgsz)
+
+    if shutil.which("ffmpeg"):
+        transcode_with_ffmpeg(video_path, tmp_path, proxy_width, proxy_height)
+    else:
+        transcode_with_opencv(video_path, tmp_path, proxy_width, proxy_height, fps)
+    os.replace(tmp_path, proxy_path)
+
+    info = {
+        "source": os.path.abspath(video_path),
+        "orig_width": width,
+        "orig_height": height,
+        "proxy_width": proxy_width,
+        "proxy_height": proxy_height,
+        "scale_x": width / proxy_width,
+        "scale_y": height / proxy_height,
+    }
+    with open(sidecar_path(proxy_path), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=2)
+    return proxy_path
+
+
+def load_proxy_info(video_path: str) -> Optional[Dict[str, Any]]:
+    """Sidecar of a proxy video, or None when video_path is an original."""
+    path = sidecar_path(video_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)